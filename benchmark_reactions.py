@@ -0,0 +1,121 @@
+import random
+import sys
+import time
+import tracemalloc
+import func
+
+#Measures the per-object memory and the per-event cost of the population and reaction
+#objects on the reaction network of the run scripts.
+#usage: python benchmark_reactions.py [networks] [events]
+networks = 1000		#networks held at once in the memory test, as when many simulations share a process
+events = 100000		#events of the timed run
+if (len(sys.argv) > 1):
+    networks = int(sys.argv[1])
+if (len(sys.argv) > 2):
+    events = int(sys.argv[2])
+
+tau = 8.0
+stimulation = 1.0
+Bcell_carry = 5000
+Bcell_aff = 10.0
+Tcell_carry = 5000
+AB_aff = 2.5
+antigen_list = func.ReadAgFile( "./ep_file.txt" )
+
+#the reactions of run_dengueinfections.py with the median rate constants
+def build_network( Bcell_initial ):
+    V = [func.Antigen("V" + str(i), 0, antigen_list[i]) for i in range(0, 4)]
+    nB_gc = func.BCell("GC_B", 0, antigen_list )
+    nB_stim = func.BCell("Stimulated_B", 0, antigen_list )
+    nB_me = func.BCell("Memory_B", 0, antigen_list )
+    nB_pls = func.BCell("SL_Plasma_B", 0, antigen_list )
+    nB_pll = func.BCell("LL_Plasma_B", 0, antigen_list )
+    nAB = func.BCell("Antibody", 0, antigen_list )
+    nB = func.BCell("Naive_B", Bcell_initial, antigen_list )
+    nB_Tstim = func.BCell("Tstimulated_B", 0, antigen_list )
+    Tcd4 = func.Population("T_cd4", 1150)
+    Tcd4_stim = func.Population("T_cd4_stim", 0)
+    Tcd4_me = func.Population("T_cd4_me", 0)
+    Tcd8 = func.Population("T_cd8", 1050)
+    Tcd8_stim = func.Population("T_cd8_stim", 0)
+    AbClear = func.Population("AbClearance", 0)
+    T8Clear = func.Population("T8Clearance", 0)
+    GC_population = func.GroupPopulation("GC Bcell Population")
+    for pop in [nB_gc, nB_stim, nB_Tstim]:
+        GC_population.add_population(pop)
+    T4_population = func.GroupPopulation("CD4 T-cell Population")
+    for pop in [Tcd4, Tcd4_stim]:
+        T4_population.add_population(pop)
+    T8_population = func.GroupPopulation("CD8 T-cell Population")
+    for pop in [Tcd8, Tcd8_stim]:
+        T8_population.add_population(pop)
+
+    A0 = func.TotalReaction()
+    A0.add_reaction(func.Formation("Naive B cell formation", tau/0.1479, nB))
+    A0.add_reaction(func.Decay("Naive B cell decay", tau/108.0, nB))
+    A0.add_reaction(func.Formation("T CD4 cell formation", tau/0.0735, Tcd4))
+    A0.add_reaction(func.Decay("T CD4 cell decay", tau/108.0, Tcd4))
+    A0.add_reaction(func.Formation("T CD8 cell formation", tau/0.1306, Tcd8))
+    A0.add_reaction(func.Decay("T CD8 cell decay", tau/108.0, Tcd8))
+    for v in V:
+        A0.add_reaction(func.Stimulation("Free Naive B Cell Stimulation", tau/360.0, v, nB, nB_gc, stimulation/6.0, Bcell_aff, "immunogenicity"))
+        A0.add_reaction(func.Stimulation("GC B Cell Stimulation", tau/20.0, v, nB_gc, nB_stim, stimulation/0.45, Bcell_aff, "immunogenicity"))
+    A0.add_reaction(func.TStimulation("T_cd4 stimulation", tau/1200.0, nB_stim, Tcd4, nB_Tstim, Tcd4_stim))
+    A0.add_reaction(func.TStimulation("T_cd4 memory stimulation", tau/2400.0, nB_stim, Tcd4_me, nB_Tstim, Tcd4_stim))
+    A0.add_reaction(func.T8Stimulation("T_cd8 stimulation", tau/8.0, Tcd4_stim, Tcd8, Tcd8_stim))
+    A0.add_reaction(func.PopulationDecay("B Cell decay", tau/(tau+1.0), tau/108.0, Bcell_carry, GC_population, nB_gc, nB_stim, nB_Tstim))
+    A0.add_reaction(func.TPopulationDecay("T_cd4 decay", tau/(tau+200.0), tau/21600.0, Tcell_carry, T4_population, Tcd4_stim))
+    A0.add_reaction(func.TPopulationDecay("T_cd8 decay", tau/(tau+200.0), tau/21600.0, Tcell_carry, T8_population, Tcd8_stim))
+    A0.add_reaction(func.BDifferentiation("B cell differentiation", tau/60.0, nB_stim, nB_gc, 1.0))
+    A0.add_reaction(func.Differentiation("Tstimulated B cell differentiation", tau/8.0, nB_Tstim, nB_gc, nB_stim, nB_me, nB_pls, nB_pll, 1.0))
+    A0.add_reaction(func.TDifferentiation("T_cd4 differentiation", tau/15.0, Tcd4_stim, Tcd4, Tcd4_me))
+    A0.add_reaction(func.T8Differentiation("T_cd8 differentiation", tau/180.0, Tcd8_stim, Tcd8))
+    A0.add_reaction(func.Production("SL plasma antibody production", 1.0, nB_pls, nAB))
+    A0.add_reaction(func.Production("LL plasma antibody production", 0.1, nB_pll, nAB))
+    A0.add_reaction(func.Decay("Antibody decay", tau/360.0, nAB))
+    A0.add_reaction(func.Decay("SL plasma decay", tau/72.0, nB_pls))
+    for v in V:
+        A0.add_reaction(func.Decay("Antigen decay", tau/8.0, v))
+        A0.add_reaction(func.AbClearance("Antibody clearance", 0.00025, v, nAB, 10000.0, AB_aff, "clearance", AbClear))
+        A0.add_reaction(func.TClearance("T_cd8 clearance", 0.000025, v, Tcd8_stim, T8Clear))
+        A0.add_reaction(func.MStimulation("Memory B Cell Stimulation", stimulation/80.0, v, nB_me, nB_pls, nB_pll, tau/24.0, Bcell_aff, "immunogenicity"))
+        A0.add_reaction(func.Replication("Antigen replication", tau/6.2, v))
+    return [A0, V]
+
+#memory held by the populations and reactions (no naive repertoire)
+random.seed(1)
+build_network( 0 )
+tracemalloc.start()
+start = tracemalloc.get_traced_memory()[0]
+kept = []
+for i in range(0, networks):
+    kept.append( build_network( 0 ) )
+used = tracemalloc.get_traced_memory()[0] - start
+tracemalloc.stop()
+n_reactions = len(kept[0][0].reaction_list)
+print( "networks " + str(networks) + ", " + str(n_reactions) + " reactions each" )
+print( "memory per network (kB) " + str(round(used/1024.0/networks, 2)) )
+kept = []
+
+#cost of reading every propensity, the attribute lookups and calls behind each event
+random.seed(2)
+network = build_network( 5000000 )
+A0 = network[0]
+for v in network[1]:
+    v.increase(25)
+reaction_list = A0.reaction_list
+repeats = 20000
+wall = time.time()
+for i in range(0, repeats):
+    for reaction in reaction_list:
+        reaction.rate()
+wall = time.time() - wall
+print( "rate() per call (ns) " + str(round(1e9*wall/(repeats*len(reaction_list)), 1)) )
+
+#cost per event of an infection
+wall = time.time()
+for i in range(0, events):
+    A0.MC_TimeStep()
+    A0.MC_React()
+wall = time.time() - wall
+print( "events " + str(events) + ", per event (us) " + str(round(1e6*wall/events, 2)) )
@@ -0,0 +1,25 @@
+import sys
+import time
+import func
+
+#Draws the naive B cell repertoire of each seed of a pool into the repertoire cache, so the
+#runs of an ensemble load it instead of generating it.
+#usage: python build_repertoire_cache.py <cache_dir> <first_seed> <seeds> [Bcell_initial] [ep_file]
+if (len(sys.argv) < 4):
+    print( "usage: python build_repertoire_cache.py <cache_dir> <first_seed> <seeds> [Bcell_initial] [ep_file]" )
+    sys.exit(1)
+func.repertoire_cache_dir = sys.argv[1]
+first_seed = int(sys.argv[2])
+seeds = int(sys.argv[3])
+Bcell_initial = 50000000	#as in the run scripts
+ep_file = "./ep_file.txt"
+if (len(sys.argv) > 4):
+    Bcell_initial = int(sys.argv[4])
+if (len(sys.argv) > 5):
+    ep_file = sys.argv[5]
+
+antigen_list = func.ReadAgFile( ep_file )
+for seed in range(first_seed, first_seed + seeds):
+    wall = time.time()
+    nB = func.BCell("Naive_B", Bcell_initial, antigen_list, seed )
+    print( "seed " + str(seed) + ", " + str(len(nB.return_size_list())) + " genotypes, " + str(nB.size()) + " cells (" + str(round(time.time() - wall, 2)) + " s) " + func.RepertoireCacheFile( antigen_list, Bcell_initial, seed ) )
@@ -0,0 +1,117 @@
+import random
+import sys
+import func
+
+#Randomized consistency check of the B cell compartments: after every operation (new cells,
+#bulk removals, transfers, thinning, registry sweeps and epitope changes that rescore the
+#registry) the clone columns, clone tree, slot index, (epitope, phenotype) counts, buckets,
+#apparent sums and registry reference counts are compared with a recount from the clones.
+#usage: python check_compartments.py [rounds] [seed] [ep_file]
+rounds = 200
+seed = 1
+ep_file = "./ep_file.txt"
+if (len(sys.argv) > 1):
+    rounds = int(sys.argv[1])
+if (len(sys.argv) > 2):
+    seed = int(sys.argv[2])
+if (len(sys.argv) > 3):
+    ep_file = sys.argv[3]
+
+def check( b ):
+    registry = b._registry
+    sizes = list(b._size_list)
+    assert b.size() == sum(sizes), (b.name(), b.size(), sum(sizes))
+    assert b._clone_tree.total() == sum(sizes), b.name()
+    assert len(b._clone_tree) == len(sizes), b.name()
+    for i in range(0, len(sizes)):
+        gid = b._id_list[i]
+        assert sizes[i] > 0, b.name()
+        assert b._index[gid] == i, b.name()
+        assert b._clone_tree.value(i) == sizes[i], b.name()
+    for antigen in b._antigen_list:
+        aid = antigen.ID()
+        counts = [[0]*20 for x in range(antigen.epitope_num())]
+        for i in range(0, len(sizes)):
+            gid = b._id_list[i]
+            counts[registry.epitope[gid]][registry.phenotype[aid][gid]] += sizes[i]
+        assert counts == [list(x) for x in b._subpopulation_master[aid]], (b.name(), aid)
+        for epitope in range(0, len(counts)):
+            for phenotype in range(0, 20):
+                bucket = b._bucket_master[aid][epitope][phenotype]
+                assert bucket.tree.total() == counts[epitope][phenotype], (b.name(), aid)
+                for pos in range(0, len(bucket.slots)):
+                    slot = bucket.slots[pos]
+                    gid = b._id_list[slot]
+                    assert b._bucket_pos[aid][slot] == pos, (b.name(), aid)
+                    assert (registry.epitope[gid], registry.phenotype[aid][gid]) == (epitope, phenotype), (b.name(), aid)
+                    assert bucket.tree.value(pos) == sizes[slot], (b.name(), aid)
+        for aggregate in b._apparent[aid]:
+            recount = func.ApparentSizeSum( aggregate.weights, b._subpopulation_master[aid] )
+            assert abs(aggregate.total - recount.total) <= 1e-6*max(1.0, abs(recount.total)), (b.name(), aid)
+            assert aggregate.count == recount.count, (b.name(), aid)
+
+#every registry id is referenced once by each compartment holding it
+def check_refs( registry, compartments ):
+    refs = {}
+    for b in compartments:
+        for gid in b._id_list:
+            refs[gid] = refs.get( gid, 0 ) + 1
+    for code in registry._id:
+        gid = registry._id[code]
+        assert registry.refs[gid] == refs.get( gid, 0 ), gid
+        assert registry.code[gid] == code, gid
+
+def random_gene( antigen_list ):
+    antigen = antigen_list[random.randrange( len(antigen_list) )]
+    gene = func.GeneFromPhenotype( random.randint(0, 12), antigen, random.randrange( antigen.epitope_num() ) )
+    if (random.random() < 0.3):
+        gene = func.IsotypeSwitch( gene )
+    return gene
+
+random.seed( seed )
+kinds = [func.BCell]
+if (func.numpy is not None):
+    kinds.append( func.ColumnBCell )
+for kind in kinds:
+    antigen_list = func.ReadAgFile( ep_file )
+    compartments = [kind("C" + str(i), 0, antigen_list) for i in range(0, 3)]
+    for b in compartments:
+        b.apparent_sum( 0, 2.5, "immunogenicity" )
+        b.apparent_sum( 1, 10.0, "clearance" )
+    registry = compartments[0]._registry
+    genes = [random_gene( antigen_list ) for i in range(0, 400)]
+    for r in range(0, rounds):
+        b = compartments[random.randrange( len(compartments) )]
+        other = compartments[random.randrange( len(compartments) )]
+        op = random.randrange( 9 )
+        if (op == 0):
+            for i in range(0, 50):
+                b.genotype_increase( genes[random.randrange( len(genes) )], random.randint(1, 5) )
+        elif (op == 1):
+            b.increase( random.randint(1, 3) )
+            b.increase_many( random.randint(0, 30) )
+        elif (op == 2):
+            b.remove_random( random.randint(0, b.size()) )
+        elif (op == 3):
+            for i in range(0, min(20, b.size())):
+                b.decrease( 1 )
+        elif (op == 4 and other is not b):
+            slots = b.sample_slots( random.randint(0, 40) )
+            other.receive( b, slots )
+            for i in sorted( slots, reverse=True ):
+                func.Population.decrease( b, min(slots[i], b._size_list[i]) )
+                b.slot_decrease( i, min(slots[i], b._size_list[i]) )
+        elif (op == 5):
+            b.thin( random.random() )
+        elif (op == 6):
+            registry.sweep()
+        elif (op == 7 and random.random() < 0.2):
+            antigen_list[random.randrange( len(antigen_list) )].epitope( 0 ).mutate()
+        elif (op == 8 and b.size() > 0):
+            gene = b.select_random()
+            b.genotype_decrease( gene, 1 )
+            other.genotype_increase( func.IsotypeSwitch( gene ), 1 )
+        for c in compartments:
+            check( c )
+        check_refs( registry, compartments )
+    print( kind.__name__ + ": " + str(rounds) + " rounds, " + str(len(registry)) + " genes registered, " + str(sum([c.size() for c in compartments])) + " cells, consistent" )
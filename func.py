@@ -3,6 +3,17 @@ import random
 import itertools
 import operator
 import copy
+import time
+import array
+import bisect
+import collections
+import hashlib
+import os
+import weakref
+try:
+	import numpy
+except ImportError:
+	numpy = None		#optional, ReplicateReaction and ColumnBCell need it, the naive repertoire uses it
 
 ln2 = math.log(2)
 
@@ -14,6 +25,9 @@ min_dist = 4
 germline_affinity = 6		
 
 isotype_position = gene_len+1
+gene_bits = max(1, (gene_vocab-1).bit_length())	#bits per position of a packed gene
+phenotype_cache_size = 200000	#(gene, antigen) phenotypes kept by PhenotypeCache
+repertoire_cache_dir = None	#directory of the cached naive repertoires (None: not cached)
 
 #immune system parameters
 differentiation_rate = 0.10	#see (1 - recycling rate) Oprea & Perelson J. Immunology 1997
@@ -38,28 +52,20 @@ def BindingAffinity( phenotype, affinity_factor ):
 #pre-calculated binding affinities for computational efficiency 
 class BindingAffinityPrecalc: 
 	def __init__( self ):
-		self._BA_list = []
-		self._aff = []
+		self._BA_list = {}	#affinity factor -> binding affinity of each phenotype
 	
 	def add_aff( self, value ):	
 		BA_array = []
 		for i in range(0, max_dist+1):
 			BA_array.append( BindingAffinity(i, value) )
-		self._aff.append( value )
-		self._BA_list.append( BA_array )
-		print("ADDING AFF VALUE " + str( value ))
-		
-	def aff_value( self, value ):
-		try:
-			i = self._aff.index( value )
-			return i
-		except ValueError:
-			self.add_aff( value )
-			return self._aff.index( value )
+		self._BA_list[value] = BA_array
+		return BA_array
 	
 	def get_BA( self, phenotype, affinity_factor ):
 		if (phenotype <= max_dist):
-			BA_array = self._BA_list[self.aff_value( affinity_factor )]
+			BA_array = self._BA_list.get( affinity_factor )
+			if (BA_array is None):
+				BA_array = self.add_aff( affinity_factor )
 			return BA_array[phenotype]
 		else:
 			return 0.0
@@ -78,6 +84,110 @@ def ApparentSize( value, phenotype, aff_factor ):
 	else:
 		return 0.0
 
+#alpha of an epitope for a reaction type
+def EpitopeAlpha( epitope, type ):
+	if (type == "immunogenicity"):
+		return epitope.immunogenicity()
+	elif (type == "clearance"):
+		return epitope.clearance()
+	print("ERROR in APPARENTSIZEPHENOTYPE")
+	return 0.0
+
+#binding affinity * alpha of each (epitope, phenotype) of an antigen, so an apparent size
+#is the dot product of the table with the (epitope, phenotype) counts. Phenotypes past the
+#table do not bind. Built once for each (aff_factor, type) and kept on the antigen, which 
+#drops its tables when its epitopes change
+def AffinityWeightTable( antigen, aff_factor, type ):
+	key = (aff_factor, type)
+	table = antigen._weights.get( key )
+	if (table is None):
+		table = []
+		for i in range(0, antigen.epitope_num()):
+			alpha = EpitopeAlpha( antigen.epitope( i ), type )
+			table.append( [BindingAffinity( j, aff_factor ) * alpha for j in range(0, min(8, max_dist+1))] )
+		antigen._weights[key] = table
+	return table
+
+#########################################
+##RANDOM VARIATES
+#########################################
+#Poisson and binomial random numbers for the tau-leaping engines. Small means are drawn
+#by inversion, large ones by transformed rejection (PTRS/BTRS, Hormann 1993), so both
+#stay exact and O(1) for the large counts reached by viral and antibody populations
+def PoissonRandom( mean ):
+	if (mean <= 0.0):
+		return 0
+	if (mean < 30.0):
+		u = random.random()
+		k = 0
+		p = math.exp(-mean)
+		cdf = p
+		while (u > cdf and k < 1000):
+			k += 1
+			p = p * mean / k
+			cdf += p
+		return k
+
+	slam = math.sqrt(mean)
+	loglam = math.log(mean)
+	b = 0.931 + 2.53*slam
+	a = -0.059 + 0.02483*b
+	invalpha = 1.1239 + 1.1328/(b - 3.4)
+	vr = 0.9277 - 3.6224/(b - 2.0)
+	while (True):
+		u = random.random() - 0.5
+		v = random.random()
+		us = 0.5 - abs(u)
+		k = int(math.floor((2.0*a/us + b)*u + mean + 0.43))
+		if (us >= 0.07 and v <= vr):
+			return k
+		if (k < 0 or (us < 0.013 and v > us)):
+			continue
+		if (v > 0.0 and math.log(v) + math.log(invalpha) - math.log(a/(us*us) + b) <= -mean + k*loglam - math.lgamma(k + 1)):
+			return k
+
+def BinomialRandom( n, p ):
+	if (n <= 0 or p <= 0.0):
+		return 0
+	if (p >= 1.0):
+		return n
+	if (p > 0.5):
+		return n - BinomialRandom( n, 1.0 - p )
+
+	q = 1.0 - p
+	if (n*p < 10.0):
+		s = p/q
+		a = (n + 1)*s
+		r = math.pow(q, n)
+		u = random.random()
+		k = 0
+		while (u > r and k < n):
+			u -= r
+			k += 1
+			r *= (a/k - s)
+		return k
+
+	spq = math.sqrt(n*p*q)
+	b = 1.15 + 2.53*spq
+	a = -0.0873 + 0.0248*b + 0.01*p
+	c = n*p + 0.5
+	vr = 0.92 - 4.2/b
+	alpha = (2.83 + 5.1/b)*spq
+	lpq = math.log(p/q)
+	m = int(math.floor((n + 1)*p))
+	h = math.lgamma(m + 1) + math.lgamma(n - m + 1)
+	while (True):
+		u = random.random() - 0.5
+		v = random.random()
+		us = 0.5 - abs(u)
+		k = int(math.floor((2.0*a/us + b)*u + c))
+		if (k < 0 or k > n):
+			continue
+		if (us >= 0.07 and v <= vr):
+			return k
+		if (v > 0.0 and math.log(v*alpha/(a/(us*us) + b)) <= h - math.lgamma(k + 1) - math.lgamma(n - k + 1) + (k - m)*lpq):
+			return k
+
 #########################################
 ##BCR GENE FUNCTIONS
 #########################################
@@ -89,68 +199,159 @@ def GeneRandom( ):
 	sequence += 'M'	#add isotype
 	return sequence
 
+#the mutated position is drawn from 1..gene_len, so the first position never
+#mutates and a draw of gene_len leaves the gene unchanged
 def GeneMutate( sequence ):
 	mutation_position = random.randint( 1, gene_len )
+	if (mutation_position < gene_len):
+		return sequence[:mutation_position] + str(random.randint(1, gene_vocab)) + sequence[mutation_position+1:]
+	return sequence
+
+def IsotypeSwitch( sequence ):
+	return sequence[:gene_len] + 'G'	#add isotype
+
+#Packed genes: gene_bits per position (symbol - 1, first position highest), followed by
+#the isotype bit (1 for 'G'). Sequences are packed without the isotype bit, and the
+#Hamming distance in shape space is a popcount over the xor of two packed sequences
+symbol_mask = (1 << gene_bits) - 1
+symbol_low = sum([1 << (gene_bits*i) for i in range( 0, gene_len )])	#lowest bit of every position
+symbol_digits = str.maketrans( '123456789', '012345678' )
+symbol_chars = [str(i + 1) for i in range( 0, symbol_mask + 1 )]
+
+def SequencePack( sequence ):
+	return int( sequence[:gene_len].translate( symbol_digits ), 1 << gene_bits )
 
-	out_seq = ""
+def SequenceUnpack( code ):
+	sequence = []
 	for i in range( 0, gene_len ):
-		if ( i == mutation_position ):
-			out_seq += str(random.randint(1, gene_vocab))
+		sequence.append( symbol_chars[code & symbol_mask] )
+		code = code >> gene_bits
+	sequence.reverse()
+	return "".join( sequence )
+
+def GenePack( sequence ):
+	code = SequencePack( sequence ) << 1
+	if (sequence[isotype_position-1:isotype_position] == 'G'):
+		code |= 1
+	return code
+
+def GeneUnpack( code ):
+	if (code & 1):
+		return SequenceUnpack( code >> 1 ) + 'G'
+	return SequenceUnpack( code >> 1 ) + 'M'
+
+#number of positions at which two packed sequences differ
+def SequenceDistance( a, b ):
+	x = a ^ b
+	y = x
+	for i in range( 1, gene_bits ):
+		y |= x >> i
+	return bin( y & symbol_low ).count( '1' )
+
+#same draws as GeneMutate and IsotypeSwitch, on packed genes
+def GeneMutatePacked( code ):
+	mutation_position = random.randint( 1, gene_len )
+	if (mutation_position < gene_len):
+		shift = 1 + gene_bits*(gene_len - 1 - mutation_position)
+		code = (code & ~(symbol_mask << shift)) | ((random.randint(1, gene_vocab) - 1) << shift)
+	return code
+
+def IsotypeSwitchPacked( code ):
+	return code | 1
+
+#closest epitope of an antigen to a packed sequence, [distance, epitope number]
+def SequencePhenotypeEpitope( packed, antigen_in ):
+	epitope = antigen_in.epitope_all()
+	dist = 999
+	epitope_num = 999
+	for i in range( 0, len( epitope ) ):
+		if (gene_bits == 2):
+			x = packed ^ epitope[i].packed()
+			hamming_dist = bin( (x | (x >> 1)) & symbol_low ).count( '1' )
 		else:
-			out_seq += sequence[i]
-	out_seq += sequence[isotype_position-1]	#add isotype
+			hamming_dist = SequenceDistance( packed, epitope[i].packed() )
+		if (hamming_dist < dist ):
+			dist = hamming_dist
+			epitope_num = i
+	return [dist, epitope_num]
+
+#recently used [distance, epitope number] of (packed sequence, antigen), so the gene 
+#functions below and GenotypeRegistry.intern do not rescore the same sequence (the isotype 
+#is not part of the key, so the isotype switches of a clone hit it). EpitopeChanged clears
+#it. Without a size it is bounded by phenotype_cache_size, read at every insertion
+class PhenotypeCache:
+	def __init__( self, size=None ):
+		self._table = collections.OrderedDict()
+		self._size = size
+		self.hits = 0
+		self.misses = 0
+
+	def phenotype_epitope( self, packed, antigen_in ):
+		key = (packed, antigen_in)
+		value = self._table.get( key )
+		if (value is not None):
+			self.hits += 1
+			self._table.move_to_end( key )
+			return value
+		self.misses += 1
+		value = tuple(SequencePhenotypeEpitope( packed, antigen_in ))
+		self._table[key] = value
+		self.trim()
+		return value
+
+	def trim( self ):
+		size = self._size
+		if (size is None):
+			size = phenotype_cache_size
+		while (len(self._table) > size):
+			self._table.popitem( last=False )
+
+	def resize( self, size ):
+		self._size = size
+		self.trim()
+
+	def clear( self ):
+		self._table.clear()
+
+	def __len__( self ):
+		return len(self._table)
+
+	def hit_rate( self ):
+		if (self.hits + self.misses == 0):
+			return 0.0
+		return float(self.hits)/(self.hits + self.misses)
 
-	return out_seq
+phenotype_cache = PhenotypeCache()
 
-def IsotypeSwitch( sequence ):
-	out_seq = ""
-	for i in range(0, gene_len):
-		out_seq += sequence[i]
-	out_seq += 'G'	#add isotype
-	return out_seq
+#every GenotypeRegistry and NaiveClassRegistry alive, so an epitope change reaches them
+scored_registries = weakref.WeakSet()
+
+#called when an epitope sequence, or the epitopes of an antigen, change: the cached 
+#phenotypes are dropped and the registries scoring against it rescore their genes
+def EpitopeChanged( changed ):
+	phenotype_cache.clear()
+	for registry in list(scored_registries):
+		if (registry.scores( changed )):
+			registry.rescore()
 
 def GenePhenotype( sequence, antigen_in ):
-		ne = operator.ne
-		epitope = antigen_in.epitope_all()
-		dist = 999
-		for i in range( 0, len( epitope ) ):
-			hamming_dist = sum(map(ne, sequence, epitope[i].get_sequence()))
-			if (hamming_dist < dist ):
-				dist = hamming_dist
-#		phenotype = min( max_dist + 1, dist )
-		phenotype = dist        
-		return phenotype
+	return phenotype_cache.phenotype_epitope( SequencePack( sequence ), antigen_in )[0]
 
 def GenePhenotypeEpitope( sequence, antigen_in ):
-		ne = operator.ne
-		epitope = antigen_in.epitope_all()
-		dist = 999
-		epitope_num = 999        
-		for i in range( 0, len( epitope ) ):
-			hamming_dist = sum(map(ne, sequence, epitope[i].get_sequence()))
-			if (hamming_dist < dist ):
-				dist = hamming_dist
-				epitope_num = i                
-#		phenotype = min( max_dist + 1, dist )
-		phenotype = dist
-		output = [phenotype, epitope_num]
-		return output
-		
+	return list(phenotype_cache.phenotype_epitope( SequencePack( sequence ), antigen_in ))
+
 def GeneEpitope( sequence, antigen_list ):
-		ne = operator.ne
-		dist = 999
-		epitope_num = 999
-		for antigen in antigen_list:
-			epitope = antigen.epitope_all()
-			for i in range( 0, len( epitope ) ):
-				hamming_dist = sum(map(ne, sequence, epitope[i].get_sequence()))
-				if (hamming_dist < dist ):
-					dist = hamming_dist
-					epitope_num = i
-		return epitope_num
-	
+	packed = SequencePack( sequence )
+	dist = 999
+	epitope_num = 999
+	for antigen in antigen_list:
+		phenotype = phenotype_cache.phenotype_epitope( packed, antigen )
+		if (phenotype[0] < dist ):
+			dist = phenotype[0]
+			epitope_num = phenotype[1]
+	return epitope_num
+
 def GeneFromPhenotype( phenotype, antigen, ep_num ):	
-	sequence = ""
 	rand_pos = []
 	for i in range(1, gene_len+1):
 		rand_pos.append( i )
@@ -158,19 +359,30 @@ def GeneFromPhenotype( phenotype, antigen, ep_num ):
 	num_match = gene_len - phenotype
 	epitope = antigen.epitope( ep_num ).get_sequence()
 
+	sequence = []
 	for i in range(0,gene_len):
 		if (rand_pos[i] <= num_match):
-			sequence += epitope[i]
+			sequence.append( epitope[i] )
 		else:
 			new_val = epitope[i]
 			while( new_val == epitope[i] ):
 				new_val = str(random.randint(1,gene_vocab))
-			sequence += new_val
+			sequence.append( new_val )
 
-	sequence += 'M'	#add isotype
+	sequence.append( 'M' )	#add isotype
 
-	return sequence
+	return "".join( sequence )
 	
+#packed sequence at distance phenotype from a packed epitope, drawn as GeneFromPhenotype
+#(phenotype random positions changed to another symbol)
+def SequenceFromPhenotype( phenotype, packed_epitope ):
+	packed = packed_epitope
+	for i in random.sample( range(0, gene_len), phenotype ):
+		shift = gene_bits*(gene_len - 1 - i)
+		symbol = (packed >> shift) & symbol_mask
+		packed ^= (symbol ^ ((symbol + random.randint(1, gene_vocab-1)) % gene_vocab)) << shift
+	return packed
+
 #########################################
 ##IMMUNE SYSTEM COMPONENT TYPES
 #########################################
@@ -179,32 +391,43 @@ def GeneFromPhenotype( phenotype, antigen, ep_num ):
 #      component. It is made up of subpopulations, each with their own genotype 
 #      and size. There are two types of Populations, Antigen and BCell (see below).
 class Population:
+	__slots__ = ('_name', '_value', '_type', '_version')
+
 	def __init__( self, name, value ):
 		self._name = name
 		self._value = value
 		self._type = ''
+		self._version = 0	#bumped on every change, read by TotalReaction
 
 	def set_type ( self, type ):
 		self._type = type
 
 	def set_size ( self, value ):
 		self._value = value
+		self._version += 1
 
 	def size( self ):
 		return self._value
 
 	def decrease(self, n ):
 		self._value = self._value - n
+		self._version += 1
 
 	def increase(self, n ):
 		self._value = self._value + n
+		self._version += 1
 
 	def name(self):
 		return str(self._name)
 
+	def members( self ):
+		return [self]
+
 #Name: GroupPopulation
 #Desc: An aggregate population that is made up of individual Population objects
 class GroupPopulation:
+	__slots__ = ('_name', '_pop', '_value')
+
 	def __init__( self, name ):
 		self._name = name
 		self._pop = []
@@ -213,6 +436,9 @@ class GroupPopulation:
 	def add_population( self, pop ):
 		self._pop.append(pop)
 
+	def members( self ):
+		return self._pop
+
 	def calc_population( self ):
 		self._value = 0
 		for i in range(0, len(self._pop) ):
@@ -251,24 +477,38 @@ class GroupPopulation:
 #Desc: Defines a single epitope, which includes an epitope sequence (in immune shape space),
 #      as well as its relative immunogenicity and clearance rates
 class Epitope:
+	__slots__ = ('_name', '_sequence', '_immunogenicity', '_clearance', '_packed')
+
 	def __init__( self, name, sequence, immunogenicity, clearance ):
 		self._name = name
 		self._sequence = sequence
 		self._immunogenicity = immunogenicity 		
 		self._clearance = clearance
+		self._packed = None		#packed sequence, made on first use
 	
 	def mutate( self ):
 		self._sequence = GeneMutate( self._sequence )
+		self._packed = None
+		EpitopeChanged( self )
 	
 	def randomize( self ):
 		self._sequence = GeneRandom()
+		self._packed = None
+		EpitopeChanged( self )
 
 	def set_sequence( self, seq ):
 		self._sequence = seq
+		self._packed = None
+		EpitopeChanged( self )
 	
 	def get_sequence( self ):
 		return self._sequence
 
+	def packed( self ):
+		if (self._packed is None):
+			self._packed = SequencePack( self._sequence )
+		return self._packed
+
 	def get_name ( self ):
 		return self._name
 		
@@ -285,12 +525,15 @@ class Epitope:
 #Desc: Defines an antigen population, which is one type of immune system component. It is 
 #      defined by a name, a population size, and an AntigenType
 class Antigen( Population ):
+	__slots__ = ('_antigen',)
+
 	def __init__( self, name, value, antigen ):
 		Population.__init__( self, name, value )
 		self._antigen = antigen
 		
 	def change_antigen( self, new_antigen ):
 		self._antigen = new_antigen
+		self._version += 1
 
 	def return_antigen( self ):
 		return self._antigen
@@ -300,13 +543,20 @@ class Antigen( Population ):
 #      antigenID, and a list of epitopes that make up the antigen
 #note: in future version, antigenID should be set internally for ease of use
 class AntigenType:
+	__slots__ = ('_name', '_epitope_array', '_antigenID', '_weights', '_version')
+
 	def __init__( self, name, antigenID ):
 		self._name = name
 		self._epitope_array = []
 		self._antigenID = antigenID
+		self._weights = {}		#AffinityWeightTable of each (aff_factor, type)
+		self._version = 0		#bumped when the epitopes are added or reset
 		
 	def add_epitope( self, ep ):
 		self._epitope_array.append( ep )
+		self._weights = {}
+		self._version += 1
+		EpitopeChanged( self )
 		
 	def epitope( self, r ):
 		return self._epitope_array[r]
@@ -319,6 +569,9 @@ class AntigenType:
 		
 	def reset_epitopes( self ):
 		self._epitope_array = []
+		self._weights = {}
+		self._version += 1
+		EpitopeChanged( self )
 
 	def ID ( self ):
 		return self._antigenID
@@ -330,67 +583,88 @@ class AntigenType:
 #Desc: Defines a B cell population. It is indexed by genotype, and keeps track of the genotype, 
 #      the size of the genotype population, the Epitope that genotype recognizes, and the phenotype
 #      of that genotype with respect to all Antigens in the system.
+#      The genotypes are held as ids of the GenotypeRegistry shared by every compartment, which 
+#      keeps the gene, its Epitope and its phenotypes, so a compartment only stores (id, size).
 class BCell( Population ):
 
+	_typecode = None	#array type of the clone columns, trees and buckets (None for lists)
+
 	def add_genotype( self, gene, n ):
-		
-		self._genotype_list.append( gene )
-		epitope = GeneEpitope(gene, self._antigen_list)
-		self._epitope_list.append( epitope )
+		self.add_clone( self._registry.intern( gene ), n )
+
+	#a new slot for n cells of a registered genotype
+	def add_clone( self, gid, n ):
+		registry = self._registry
+		registry.retain( gid )
+		self._index[gid] = len(self._id_list)
+		self._id_list.append( gid )
+		self._clone_tree.append( n )
+		epitope = registry.epitope[gid]
 		self._size_list.append( n )
 	
 		for antigen in self._antigen_list:
-			phenotype = GenePhenotype(gene, antigen)
-		
-			phenotype_list = self._phenotype_master[antigen.ID()]
-			phenotype_list.append( phenotype )
+			phenotype = registry.phenotype[antigen.ID()][gid]
 			subpopulation = self._subpopulation_master[antigen.ID()]
 			subpopulation[epitope][phenotype] += n
+			for aggregate in self._apparent[antigen.ID()]:
+				aggregate.change( epitope, phenotype, n )
+			bucket = self._bucket_master[antigen.ID()][epitope][phenotype]
+			self._bucket_pos[antigen.ID()].append( bucket.add( len(self._id_list) - 1, n ) )
+
+	#the registry id -> slot map of the compartment
+	def slot_index( self ):
+		return {}
+
+	#a clone column of the compartment's type
+	def column( self, values ):
+		if (self._typecode is None):
+			return list(values)
+		return array.array(self._typecode, values)
+
+	#sorts the clones into the (epitope, phenotype) buckets of every antigen
+	def build_buckets( self ):
+		epitope_num = self._antigen_list[0].epitope_num()
+		registry = self._registry
+		self._bucket_master = []
+		self._bucket_pos = []
+		for antigen in self._antigen_list:
+			buckets = [[CloneBucket( self._typecode ) for j in range(20)] for x in range(epitope_num)]
+			phenotype_list = registry.phenotype[antigen.ID()]
+			bucket_pos = self.column( [] )
+			for i in range(0, len(self._size_list)):
+				gid = self._id_list[i]
+				bucket = buckets[registry.epitope[gid]][phenotype_list[gid]]
+				bucket_pos.append( bucket.add( i, self._size_list[i] ) )
+			self._bucket_master.append( buckets )
+			self._bucket_pos.append( bucket_pos )
 
 	def phenotype_size( self, phenotype, antigenID ):	
 		pop_size = 0
-		phenotype_list = self._phenotype_master[antigenID]
-		for i in range(0, len(phenotype_list)):
-			if (phenotype_list[i] == phenotype):
+		phenotype_list = self._registry.phenotype[antigenID]
+		for i in range(0, len(self._id_list)):
+			if (phenotype_list[self._id_list[i]] == phenotype):
 				pop_size += self._size_list[i]
 		return pop_size
 		
 	def epitope_size( self, epitope ):
 		pop_size = 0
-		for i in range(0, len(self._epitope_list)):
-			if (self._epitope_list[i] == epitope):
+		for i in range(0, len(self._id_list)):
+			if (self._registry.epitope[self._id_list[i]] == epitope):
 				pop_size += self._size_list[i]
 		return pop_size
 
 	def RealSizePhenotype( self, epitope, phenotype, type, antigenID):
 		subpopulation = self._subpopulation_master[antigenID]
 		n = subpopulation[epitope][phenotype]
-		alpha = 0.0
-	
-		if (type == "immunogenicity"):
-			alpha = self._antigen_list[antigenID].epitope( epitope ).immunogenicity()
-		elif (type == "clearance"):
-			alpha = self._antigen_list[antigenID].epitope( epitope ).clearance()
-		else:
-			print( "ERROR in APPARENTSIZEPHENOTYPE")
-		
-		real_size = n * alpha
+		real_size = n * EpitopeAlpha( self._antigen_list[antigenID].epitope( epitope ), type )
 		return real_size
 
 	def ApparentSizePhenotype( self, epitope, phenotype, aff_factor, type, antigenID):
 		subpopulation = self._subpopulation_master[antigenID]
-		n = subpopulation[epitope][phenotype]
-		
-		alpha = 0.0
-		if (type == "immunogenicity"):
-			alpha = self._antigen_list[antigenID].epitope( epitope ).immunogenicity()
-		elif (type == "clearance"):
-			alpha = self._antigen_list[antigenID].epitope( epitope ).clearance()
-		else:
-			print("ERROR in APPARENTSIZEPHENOTYPE")
-	
-		app_size = ApparentSize( n, phenotype, aff_factor ) * alpha
-		return app_size
+		weights = AffinityWeightTable( self._antigen_list[antigenID], aff_factor, type )[epitope]
+		if (phenotype < len(weights)):
+			return subpopulation[epitope][phenotype] * weights[phenotype]
+		return 0.0
 		
 	def ApparentSizeEpitope( self, epitope, aff_factor, type, antigenID):
 		app_size = 0.0
@@ -398,82 +672,103 @@ class BCell( Population ):
 			app_size += self.ApparentSizePhenotype( epitope, i, aff_factor, type, antigenID )
 		return app_size
 		
-	def ApparentSizeAll( self, aff_factor, type, virus ):
-		antigenID = virus.return_antigen().ID()
-		app_size = 0.0
-		for i in range(0, self._antigen_list[0].epitope_num() ):
-			app_size += self.ApparentSizeEpitope( i, aff_factor, type, antigenID)
-		return app_size
+	#(epitope, phenotype) counts of an antigen
+	def subpopulation( self, antigenID ):
+		return self._subpopulation_master[antigenID]
+
+	#number of cells within binding distance (phenotype <= max_dist) of an antigen
+	def binding_size( self, antigenID ):
+		subpopulation = self._subpopulation_master[antigenID]
+		pop_size = 0
+		for i in range(0, len(subpopulation)):
+			for j in range(0, min(8, max_dist+1)):
+				pop_size += subpopulation[i][j]
+		return pop_size
 
+	#read from a running sum, which is kept from the first call for each (antigen, aff_factor, type)
+	def ApparentSizeAll( self, aff_factor, type, virus ):
+		return self.apparent_sum( virus.return_antigen().ID(), aff_factor, type ).total
+
+	#the running ApparentSizeSum, the same object for the life of the compartment
+	def apparent_sum( self, antigenID, aff_factor, type ):
+		aggregate = self._apparent_index.get( (antigenID, aff_factor, type) )
+		if (aggregate is None):
+			aggregate = self.track_apparent( antigenID, aff_factor, type )
+		return aggregate
+
+	def track_apparent( self, antigenID, aff_factor, type ):
+		weights = AffinityWeightTable( self._antigen_list[antigenID], aff_factor, type )
+		aggregate = ApparentSizeSum( weights, self._subpopulation_master[antigenID] )
+		self._apparent[antigenID].append( aggregate )
+		self._apparent_index[ (antigenID, aff_factor, type) ] = aggregate
+		return aggregate
+
+	def build_apparent( self ):
+		for antigenID in range(0, len(self._apparent)):
+			for aggregate in self._apparent[antigenID]:
+				aggregate.build( self._subpopulation_master[antigenID] )
+
+	#re-sorts the clones after the registry scored them again (an epitope change)
+	def rescore( self ):
+		registry = self._registry
+		epitope_num = self._antigen_list[0].epitope_num()
+		for antigen in self._antigen_list:
+			subpopulation = [[0]*20 for x in range(epitope_num)]
+			phenotype_list = registry.phenotype[antigen.ID()]
+			for i in range(0, len(self._id_list)):
+				gid = self._id_list[i]
+				subpopulation[registry.epitope[gid]][phenotype_list[gid]] += self._size_list[i]
+			self._subpopulation_master[antigen.ID()] = subpopulation
+		for key in self._apparent_index:
+			self._apparent_index[key].weights = AffinityWeightTable( self._antigen_list[key[0]], key[1], key[2] )
+		self.build_buckets()
+		self.build_apparent()
+		self._version += 1
+
+	#picks a clone with probability proportional to its size, O(log G) through the clone tree
 	def select_random( self ):
 		r = random.random()
-		outcome = float(0.0)
-
-		for i in range(0, len(self._genotype_list)):
-			outcome += float(self._size_list[i])/float(Population.size( self ))
-			if (r <= outcome):
-				return str(self._genotype_list[i])
-				break
-		print("ERROR: COULD NOT FIND RANDOM select random " + str(self.name()) )
+		total = self._clone_tree.total()
+		if (total <= 0):
+			print("ERROR: COULD NOT FIND RANDOM select random " + str(self.name()) )
+			return None
+		return self._registry.gene( self._id_list[ self._clone_tree.search( r*total ) ] )
+
+	#removes a cell picked as select_random picks it and returns its packed gene, so the 
+	#gene is never unpacked
+	def take_random_code( self ):
+		r = random.random()
+		total = self._clone_tree.total()
+		if (total <= 0):
+			print("ERROR: COULD NOT FIND RANDOM select random " + str(self.name()) )
+			return None
+		i = self._clone_tree.search( r*total )
+		code = self._registry.code[ self._id_list[i] ]
+		Population.decrease( self, 1 )
+		self.slot_decrease( i, 1 )
+		return code
+
+	#adds n cells of a packed gene
+	def code_increase( self, code, n ):
+		self.clone_increase( self._registry.intern_code( code ), n )
 		
+	#picks a clone of the (epitope, phenotype) bucket by size, O(log bucket size)
 	def select_epitope_phenotype( self, epitope, phenotype, antigenID ):
 		r = random.random()
-		outcome = float(0.0)
 
 		subpopulation = self._subpopulation_master[antigenID]
-		phenotype_list = self._phenotype_master[antigenID]
 		pop_size = subpopulation[epitope][phenotype]
+		bucket = self._bucket_master[antigenID][epitope][phenotype]
 
-		tot_size = 0	
-		for i in range(0, len(self._genotype_list)):
-			#correct = 0.0
-			if (phenotype_list[i] == phenotype and self._epitope_list[i] == epitope ):
-				#correct = 1.0
-				tot_size += self._size_list[i]
-				outcome += (float(self._size_list[i]) )/float(pop_size)
-			if (r <= outcome):
-				return str(self._genotype_list[i])
-				break
-		print("ERROR: COULD NOT FIND ###RANDOM select phenotype " + str(self._name) + ' ' + str(r) + ' ' +str(outcome) + ' ' + ' ' + str(tot_size) + ' ' + str(pop_size))
-		
-	def select_random_weighted( self, aff_factor, max_rate, type, agg_rate, antigen ):
-
-		#construct phenotype probability
-		r = random.random()
-		
-		base_phenotype = 999
-		base_epitope = 999
+		tot_size = bucket.tree.total()
+		if (tot_size <= 0):
+			print("ERROR: COULD NOT FIND ###RANDOM select phenotype " + str(self._name) + ' ' + str(r) + ' ' + str(tot_size) + ' ' + str(pop_size))
+			return None
+		return self._registry.gene( self._id_list[ bucket.sample( r ) ] )
 		
-		total_p = 0.0
-		for i in range(0, antigen.epitope_num() ):
-			for j in range(0,8):
-				p_size = min(self.ApparentSizePhenotype( i, j, aff_factor, type, antigen.ID())*agg_rate , self.RealSizePhenotype(i, j, type, antigen.ID())*max_rate)
-				total_p += p_size 
-		
-		found_it = 1
-		outcome = 0.0
-		for i in range(0, antigen.epitope_num() ):
-			for j in range(0,8):
-				p_size = min(self.ApparentSizePhenotype( i, j, aff_factor, type, antigen.ID())*agg_rate , self.RealSizePhenotype(i, j, type, antigen.ID())*max_rate)
-				outcome += p_size/total_p
-				if (r <= outcome  and found_it == 1):
-					base_epitope = i
-					base_phenotype = j
-					found_it = 0
-					
-		if ( base_epitope == 999 or base_phenotype == 999):
-			print("ERROR PHENOTYPE/EPITOPE NOT SELECTED IN REACT")
-	
-		subpopulation = self._subpopulation_master[antigen.ID()]	
-		pop_size = subpopulation[base_epitope][base_phenotype]
-		if (pop_size <= 0):
-			print("ERROR: POPULATION SIZE FOR #PHENOTYPE " + str(base_phenotype) + " IS ZERO " + self.name() )
-			
-		return self.select_epitope_phenotype( base_epitope, base_phenotype, antigen.ID() )
-
 	def diversity(self, threshold):
 		line_count = 0
-		for i in range(0, len(self._genotype_list)):
+		for i in range(0, len(self._size_list)):
 			if (self._size_list[i] >= threshold):
 				line_count = line_count + 1
 
@@ -484,7 +779,7 @@ class BCell( Population ):
 		sort_list = sorted( self._size_list, reverse = True )
 		gene_count = 0
 		pop_count = 0
-		for i in range(0, len(self._genotype_list)):
+		for i in range(0, len(self._size_list)):
 			if (pop_count < num):
 				pop_count += sort_list[i]
 				gene_count += 1
@@ -493,40 +788,105 @@ class BCell( Population ):
 
 	def genotype_increase( self, gene, n):
 		Population.increase( self, n )
-		try:
-			i = self._genotype_list.index( gene )
-			self._size_list[i] += n
-
-			for antigen in self._antigen_list:
-				subpopulation = self._subpopulation_master[antigen.ID()]
-				phenotype_list = self._phenotype_master[antigen.ID()]
-				subpopulation[self._epitope_list[i]][phenotype_list[i]] += n
-
-		except ValueError:
+		i = self._index.get( self._registry.lookup( gene ) )
+		if (i is None):
 			self.add_genotype( gene, n )
+			return
+		self.slot_increase( i, n )
+
+	#adds n cells of a registered genotype
+	def clone_increase( self, gid, n ):
+		Population.increase( self, n )
+		i = self._index.get( gid )
+		if (i is None):
+			self.add_clone( gid, n )
+			return
+		self.slot_increase( i, n )
+
+	#adds the cells drawn from the slots of another compartment, {slot: cells}. Compartments
+	#sharing a registry pass the genotype ids, otherwise every cell passes its gene
+	def receive( self, source, slots ):
+		if (source._registry is self._registry):
+			for i in slots:
+				self.clone_increase( source._id_list[i], slots[i] )
+			return
+		for i in slots:
+			for j in range(0, slots[i]):
+				self.genotype_increase( source._registry.gene( source._id_list[i] ), 1 )
+
+	#adds n cells to the clone in slot i (the population size is left to the caller)
+	def slot_increase( self, i, n ):
+		self._size_list[i] += n
+		self._clone_tree.add( i, n )
+
+		gid = self._id_list[i]
+		epitope = self._registry.epitope[gid]
+		for antigen in self._antigen_list:
+			subpopulation = self._subpopulation_master[antigen.ID()]
+			phenotype = self._registry.phenotype[antigen.ID()][gid]
+			subpopulation[epitope][phenotype] += n
+			for aggregate in self._apparent[antigen.ID()]:
+				aggregate.change( epitope, phenotype, n )
+			bucket = self._bucket_master[antigen.ID()][epitope][phenotype]
+			bucket.tree.add( self._bucket_pos[antigen.ID()][i], n )
 			
 	def genotype_decrease( self, gene, n ):
 		Population.decrease(self, n )
 		
-		try:
-			i = self._genotype_list.index( gene )
-			for antigen in self._antigen_list:
-				phenotype_list = self._phenotype_master[antigen.ID()]
-				subpopulation = self._subpopulation_master[antigen.ID()]
-				subpopulation[self._epitope_list[i]][phenotype_list[i]] -= n
-			
-			if ((self._size_list[i] - n) <= 0):
-				self._size_list.pop(i)
-				self._genotype_list.pop(i)
-				self._epitope_list.pop(i)
-				for antigen in self._antigen_list:
-					phenotype_list = self._phenotype_master[antigen.ID()]
-					phenotype_list.pop(i)
-			else:
-				self._size_list[i] -= n
-				
-		except ValueError:
+		i = self._index.get( self._registry.lookup( gene ) )
+		if (i is None):
 			print(str(self._name) + " "+ str(Population.size(self)) +str(gene)+" is not in the list!!")
+			return
+		self.slot_decrease( i, n )
+
+	#removes n cells of the clone in slot i (the population size is left to the caller)
+	def slot_decrease( self, i, n ):
+		gid = self._id_list[i]
+		epitope = self._registry.epitope[gid]
+		for antigen in self._antigen_list:
+			phenotype = self._registry.phenotype[antigen.ID()][gid]
+			subpopulation = self._subpopulation_master[antigen.ID()]
+			subpopulation[epitope][phenotype] -= n
+			for aggregate in self._apparent[antigen.ID()]:
+				aggregate.change( epitope, phenotype, -n )
+		
+		if ((self._size_list[i] - n) <= 0):
+			self.remove_genotype( i )
+		else:
+			self._size_list[i] -= n
+			self._clone_tree.add( i, -n )
+			for antigen in self._antigen_list:
+				phenotype = self._registry.phenotype[antigen.ID()][gid]
+				bucket = self._bucket_master[antigen.ID()][epitope][phenotype]
+				bucket.tree.add( self._bucket_pos[antigen.ID()][i], -n )
+
+	#the last genotype is moved into the freed slot, so removal does not shift the lists
+	def remove_genotype( self, i ):
+		registry = self._registry
+		last = len(self._id_list) - 1
+		gid = self._id_list[i]
+		last_gid = self._id_list[last]
+		del self._index[ gid ]
+		for antigen in self._antigen_list:
+			phenotype_list = registry.phenotype[antigen.ID()]
+			bucket_pos = self._bucket_pos[antigen.ID()]
+			buckets = self._bucket_master[antigen.ID()]
+			moved = buckets[registry.epitope[gid]][phenotype_list[gid]].remove( bucket_pos[i] )
+			if (moved is not None):
+				bucket_pos[moved] = bucket_pos[i]
+			if (i != last):
+				buckets[registry.epitope[last_gid]][phenotype_list[last_gid]].slots[bucket_pos[last]] = i
+				bucket_pos[i] = bucket_pos[last]
+			bucket_pos.pop()
+		if (i != last):
+			self._clone_tree.add( i, self._size_list[last] - self._size_list[i] )
+			self._size_list[i] = self._size_list[last]
+			self._id_list[i] = last_gid
+			self._index[ last_gid ] = i
+		self._size_list.pop()
+		self._id_list.pop()
+		self._clone_tree.pop()
+		registry.release( gid )
 		
 	def increase( self, n ):
 			
@@ -566,234 +926,130 @@ class BCell( Population ):
 	def decrease( self, n ):
 		self.genotype_decrease( self.select_random(), 1 )
 
+	#k new cells drawn as increase() draws them (a random phenotype from 7 to gene_len of a
+	#random epitope of a random antigen), on packed genes and added once per distinct gene
+	def increase_many( self, k ):
+		antigen_list = self._antigen_list
+		n_epitope = antigen_list[0].epitope_num()
+		codes = {}
+		for j in range(0, k):
+			phenotype = random.randint( 7, gene_len )
+			antigen = antigen_list[random.randrange( len(antigen_list) )]
+			code = SequenceFromPhenotype( phenotype, antigen.epitope( random.randrange( n_epitope ) ).packed() ) << 1
+			codes[code] = codes.get( code, 0 ) + 1
+		for code in codes:
+			self.code_increase( code, codes[code] )
+
+	#k cells drawn by size with replacement, as {slot: cells}. Once there are more draws than
+	#clones, the draws are split over the clones by conditional binomials
+	def sample_slots( self, k ):
+		slots = {}
+		total = self._clone_tree.total()
+		if (k <= 0 or total <= 0):
+			return slots
+		if (k < len(self._size_list)):
+			for j in range(0, k):
+				i = self._clone_tree.search( random.random()*total )
+				slots[i] = slots.get( i, 0 ) + 1
+			return slots
+		for i in range(0, len(self._size_list)):
+			n = BinomialRandom( k, float(self._size_list[i])/total )
+			if (n > 0):
+				slots[i] = n
+				k -= n
+			total -= self._size_list[i]
+			if (k == 0 or total <= 0):
+				break
+		return slots
+
+	#removes k cells drawn by size without replacement, as k calls of decrease(1) would. The
+	#draws are taken off the clone tree, then every clone drawn is decreased once, from the
+	#last slot down so the swap-with-last removals never move a slot still to be decreased
+	def remove_random( self, k ):
+		tree = self._clone_tree
+		total = tree.total()
+		k = min(k, total)
+		if (k <= 0):
+			return
+		slots = {}
+		for j in range(0, k):
+			i = tree.search( random.random()*total )
+			tree.add( i, -1 )
+			total -= 1
+			slots[i] = slots.get( i, 0 ) + 1
+		for i in slots:
+			tree.add( i, slots[i] )
+		Population.decrease( self, k )
+		for i in sorted( slots, reverse=True ):
+			self.slot_decrease( i, slots[i] )
+
+	#keeps every cell independently with probability p. The cells lost are Binomial(cells, 
+	#1-p), removed uniformly without replacement while they are fewer than the clones, 
+	#otherwise each clone is thinned binomially; only the clones losing cells are updated
+	def thin( self, p ):
+		total = self._clone_tree.total()
+		removed = total - BinomialRandom( total, p )
+		if (removed < len(self._size_list)):
+			self.remove_random( removed )
+			return
+		lost = []
+		removed = 0
+		for i in range(0, len(self._size_list)):
+			n = self._size_list[i] - BinomialRandom( self._size_list[i], p )
+			if (n > 0):
+				lost.append( [i, n] )
+				removed += n
+		Population.decrease( self, removed )
+		for i, n in reversed( lost ):
+			self.slot_decrease( i, n )
+
+	#which antigens (bit k for the k-th) each clone binds
+	def binding_mask( self ):
+		mask = [0]*len(self._id_list)
+		for k in range(0, len(self._antigen_list)):
+			bit = 1 << k
+			phenotype_list = self._registry.phenotype[self._antigen_list[k].ID()]
+			mask = [m | bit if phenotype_list[gid] <= max_dist else m for m, gid in zip(mask, self._id_list)]
+		return mask
+
+	#cells binding the same epitope of each antigen they bind, by binding pattern and epitope
 	def calc_crossreactivity_specificity( self, antigen_list ):
-		output = []
-		for i in range(0,60):
-			output.append(0)        
-		for i in range(0, len(self._genotype_list)):
-			phen_epit1 = GenePhenotypeEpitope( self._genotype_list[i], self._antigen_list[0] )
-			phen_epit2 = GenePhenotypeEpitope( self._genotype_list[i], self._antigen_list[1] )
-			phen_epit3 = GenePhenotypeEpitope( self._genotype_list[i], self._antigen_list[2] )
-			phen_epit4 = GenePhenotypeEpitope( self._genotype_list[i], self._antigen_list[3] )
-			
-			if (phen_epit1[0] <= max_dist and phen_epit2[0] <= max_dist and phen_epit3[0] <= max_dist and phen_epit4[0] <= max_dist):
-				if (phen_epit1[1] == 0 and phen_epit2[1] == 0 and phen_epit3[1] == 0 and phen_epit4[1] == 0):
-					output[0] += self._size_list[i]
-				elif (phen_epit1[1] == 1 and phen_epit2[1] == 1 and phen_epit3[1] == 1 and phen_epit4[1] == 1):
-					output[1] += self._size_list[i]
-				elif (phen_epit1[1] == 2 and phen_epit2[1] == 2 and phen_epit3[1] == 2 and phen_epit4[1] == 2):
-					output[2] += self._size_list[i]
-				elif (phen_epit1[1] == 3 and phen_epit2[1] == 3 and phen_epit3[1] == 3 and phen_epit4[1] == 3):
-					output[3] += self._size_list[i]
-			elif (phen_epit1[0] <= max_dist and phen_epit2[0] <= max_dist and phen_epit3[0] <= max_dist):
-				if (phen_epit1[1] == 0 and phen_epit2[1] == 0 and phen_epit3[1] == 0):
-					output[4] += self._size_list[i]
-				elif (phen_epit1[1] == 1 and phen_epit2[1] == 1 and phen_epit3[1] == 1):
-					output[5] += self._size_list[i]
-				elif (phen_epit1[1] == 2 and phen_epit2[1] == 2 and phen_epit3[1] == 2):
-					output[6] += self._size_list[i]
-				elif (phen_epit1[1] == 3 and phen_epit2[1] == 3 and phen_epit3[1] == 3):
-					output[7] += self._size_list[i]
-			elif (phen_epit1[0] <= max_dist and phen_epit2[0] <= max_dist and phen_epit4[0] <= max_dist):
-				if (phen_epit1[1] == 0 and phen_epit2[1] == 0 and phen_epit4[1] == 0):
-					coutput[8] += self._size_list[i]
-				elif (phen_epit1[1] == 1 and phen_epit2[1] == 1 and phen_epit4[1] == 1):
-					output[9] += self._size_list[i]
-				elif (phen_epit1[1] == 2 and phen_epit2[1] == 2 and phen_epit4[1] == 2):
-					output[10] += self._size_list[i]
-				elif (phen_epit1[1] == 3 and phen_epit2[1] == 3 and phen_epit4[1] == 3):
-					output[11] += self._size_list[i]
-			elif (phen_epit1[0] <= max_dist and phen_epit3[0] <= max_dist and phen_epit4[0] <= max_dist):
-				if (phen_epit1[1] == 0 and phen_epit3[1] == 0 and phen_epit4[1] == 0):
-					output[12] += self._size_list[i]
-				elif (phen_epit1[1] == 1 and phen_epi3[1] == 1 and phen_epit4[1] == 1):
-					output[13] += self._size_list[i]
-				elif (phen_epit1[1] == 2 and phen_epit3[1] == 2 and phen_epit4[1] == 2):
-					output[14] += self._size_list[i]
-				elif (phen_epit1[1] == 3 and phen_epit3[1] == 3 and phen_epit4[1] == 3):
-					output[15] += self._size_list[i]                    
-			elif (phen_epit2[0] <= max_dist and phen_epit3[0] <= max_dist and phen_epit4[0] <= max_dist):
-				if (phen_epit2[1] == 0 and phen_epit3[1] == 0 and phen_epit4[1] == 0):
-					output[16] += self._size_list[i]
-				elif (phen_epit2[1] == 1 and phen_epi3[1] == 1 and phen_epit4[1] == 1):
-					output[17] += self._size_list[i]
-				elif (phen_epit2[1] == 2 and phen_epit3[1] == 2 and phen_epit4[1] == 2):
-					output[18] += self._size_list[i]
-				elif (phen_epit2[1] == 3 and phen_epit3[1] == 3 and phen_epit4[1] == 3):
-					output[19] += self._size_list[i]                    
-			elif (phen_epit1[0] <= max_dist and phen_epit2[0] <= max_dist):
-				if (phen_epit1[1] == 0 and phen_epit2[1] == 0):
-					output[20] += self._size_list[i]
-				elif (phen_epit1[1] == 1 and phen_epi2[1] == 1):
-					output[21] += self._size_list[i]
-				elif (phen_epit1[1] == 2 and phen_epit2[1] == 2):
-					output[22] += self._size_list[i]
-				elif (phen_epit1[1] == 3 and phen_epit2[1] == 3):
-					output[23] += self._size_list[i]
-			elif (phen_epit1[0] <= max_dist and phen_epit3[0] <= max_dist):
-				if (phen_epit1[1] == 0 and phen_epit3[1] == 0):
-					output[24] += self._size_list[i]
-				elif (phen_epit1[1] == 1 and phen_epi3[1] == 1):
-					output[25] += self._size_list[i]
-				elif (phen_epit1[1] == 2 and phen_epit3[1] == 2):
-					output[26] += self._size_list[i]
-				elif (phen_epit1[1] == 3 and phen_epit3[1] == 3):
-					output[27] += self._size_list[i]
-			elif (phen_epit1[0] <= max_dist and phen_epit4[0] <= max_dist):
-				if (phen_epit1[1] == 0 and phen_epit4[1] == 0):
-					output[28] += self._size_list[i]
-				elif (phen_epit1[1] == 1 and phen_epi4[1] == 1):
-					output[29] += self._size_list[i]
-				elif (phen_epit1[1] == 2 and phen_epit4[1] == 2):
-					output[30] += self._size_list[i]
-				elif (phen_epit1[1] == 3 and phen_epit4[1] == 3):
-					output[31] += self._size_list[i]
-			elif (phen_epit2[0] <= max_dist and phen_epit3[0] <= max_dist):
-				if (phen_epit2[1] == 0 and phen_epit3[1] == 0):
-					output[32] += self._size_list[i]
-				elif (phen_epit2[1] == 1 and phen_epi3[1] == 1):
-					output[33] += self._size_list[i]
-				elif (phen_epit2[1] == 2 and phen_epit3[1] == 2):
-					output[34] += self._size_list[i]
-				elif (phen_epit2[1] == 3 and phen_epit3[1] == 3):
-					output[35] += self._size_list[i] 
-			elif (phen_epit2[0] <= max_dist and phen_epit4[0] <= max_dist):
-				if (phen_epit2[1] == 0 and phen_epit4[1] == 0):
-					output[36] += self._size_list[i]
-				elif (phen_epit2[1] == 1 and phen_epi4[1] == 1):
-					output[37] += self._size_list[i]
-				elif (phen_epit2[1] == 2 and phen_epit4[1] == 2):
-					output[38] += self._size_list[i]
-				elif (phen_epit2[1] == 3 and phen_epit4[1] == 3):
-					output[39] += self._size_list[i]
-			elif (phen_epit3[0] <= max_dist and phen_epit4[0] <= max_dist):
-				if (phen_epit3[1] == 0 and phen_epit4[1] == 0):
-					output[40] += self._size_list[i]
-				elif (phen_epit3[1] == 1 and phen_epi4[1] == 1):
-					output[41] += self._size_list[i]
-				elif (phen_epit3[1] == 2 and phen_epit4[1] == 2):
-					output[42] += self._size_list[i]
-				elif (phen_epit3[1] == 3 and phen_epit4[1] == 3):
-					output[43] += self._size_list[i]                   
-			elif (phen_epit1[0] <= max_dist):
-				if (phen_epit1[1] == 0):
-					output[44] += self._size_list[i]
-				elif (phen_epit1[1] == 1):
-					output[45] += self._size_list[i]
-				elif (phen_epit1[1] == 2):
-					output[46] += self._size_list[i]
-				elif (phen_epit1[1] == 3):
-					output[47] += self._size_list[i]                    
-			elif (phen_epit2[0] <= max_dist):
-				if (phen_epit2[1] == 0):
-					output[48] += self._size_list[i]
-				elif (phen_epit2[1] == 1):
-					output[49] += self._size_list[i]	
-				elif (phen_epit2[1] == 2):
-					output[50] += self._size_list[i]
-				elif (phen_epit2[1] == 3):
-					output[51] += self._size_list[i]
-			elif (phen_epit3[0] <= max_dist):
-				if (phen_epit3[1] == 0):
-					output[52] += self._size_list[i]
-				elif (phen_epit3[1] == 1):
-					output[53] += self._size_list[i]	
-				elif (phen_epit3[1] == 2):
-					output[54] += self._size_list[i]
-				elif (phen_epit3[1] == 3):
-					output[55] += self._size_list[i]
-			elif (phen_epit4[0] <= max_dist):
-				if (phen_epit4[1] == 0):
-					output[56] += self._size_list[i]
-				elif (phen_epit4[1] == 1):
-					output[57] += self._size_list[i]	
-				elif (phen_epit4[1] == 2):
-					output[58] += self._size_list[i]
-				elif (phen_epit4[1] == 3):
-					output[59] += self._size_list[i]                   
+		output = [0]*60
+		mask = self.binding_mask()
+		for i in range(0, len(self._id_list)):
+			if ((mask[i] & 15) == 0):
+				continue
+			epitopes = []
+			for k in range(0, 4):
+				if (mask[i] & (1 << k)):
+					epitopes.append( self._registry.nearest[self._antigen_list[k].ID()][self._id_list[i]] )
+			if (epitopes.count( epitopes[0] ) == len(epitopes) and epitopes[0] < 4):
+				output[4*crossreactivity_group[mask[i] & 15] + epitopes[0]] += self._size_list[i]
 		return output
 
 	def calc_crossreactivity( self, antigen_list ):
-		output = []
-		for i in range(0,16):
-			output.append(0)
-		for i in range(0, len(self._genotype_list)):
-			phenotype1 = GenePhenotype( self._genotype_list[i], self._antigen_list[0] )
-			phenotype2 = GenePhenotype( self._genotype_list[i], self._antigen_list[1] )
-			phenotype3 = GenePhenotype( self._genotype_list[i], self._antigen_list[2] )
-			phenotype4 = GenePhenotype( self._genotype_list[i], self._antigen_list[3] )
-
-			if (phenotype1 <= max_dist and phenotype2 <= max_dist and phenotype3 <= max_dist and phenotype4 <= max_dist):
-				output[0] += self._size_list[i]
-			elif (phenotype1 <= max_dist and phenotype2 <= max_dist and phenotype3 <= max_dist):
-				output[1] += self._size_list[i]
-			elif (phenotype1 <= max_dist and phenotype2 <= max_dist and phenotype4 <= max_dist):
-				output[2] += self._size_list[i]
-			elif (phenotype1 <= max_dist and phenotype3 <= max_dist and phenotype4 <= max_dist):
-				output[3] += self._size_list[i]
-			elif (phenotype2 <= max_dist and phenotype3 <= max_dist and phenotype4 <= max_dist):
-				output[4] += self._size_list[i]              
-			elif (phenotype1 <= max_dist and phenotype2 <= max_dist):
-				output[5] += self._size_list[i]
-			elif (phenotype1 <= max_dist and phenotype3 <= max_dist):
-				output[6] += self._size_list[i]
-			elif (phenotype1 <= max_dist and phenotype4 <= max_dist):
-				output[7] += self._size_list[i]
-			elif (phenotype2 <= max_dist and phenotype3 <= max_dist):
-				output[8] += self._size_list[i]
-			elif (phenotype2 <= max_dist and phenotype4 <= max_dist):
-				output[9] += self._size_list[i]
-			elif (phenotype3 <= max_dist and phenotype4 <= max_dist):
-				output[10] += self._size_list[i]                
-			elif (phenotype1 <= max_dist):
-				output[11] += self._size_list[i]
-			elif (phenotype2 <= max_dist):
-				output[12] +=self._size_list[i]
-			elif (phenotype3 <= max_dist):
-				output[13] +=self._size_list[i]
-			elif (phenotype4 <= max_dist):
-				output[14] +=self._size_list[i]                
-			else:
-				output[15] +=self._size_list[i]
+		output = [0]*16
+		for m, n in zip(self.binding_mask(), self._size_list):
+			output[crossreactivity_group[m & 15]] += n
 		return output
 
 	def calc_transcend( self, antigen_list ):
-		output = []
-		for i in range(0,len(antigen_list)+1):
-			output.append(0)
-		
-		for i in range(0, len(self._genotype_list)):
-			strain_num = 0
-			#for antigen in self._antigen_list:
-			for j in range(0, len(antigen_list)-1):
-				phen = GenePhenotype( self._genotype_list[i], self._antigen_list[j] )
-				if (phen <= max_dist):
-					strain_num += 1
-			output[strain_num] += self._size_list[i]
+		output = [0]*(len(antigen_list)+1)
+		strain_num = [0]*len(self._id_list)
+		for j in range(0, len(antigen_list)-1):
+			phenotype_list = self._registry.phenotype[self._antigen_list[j].ID()]
+			strain_num = [s + (phenotype_list[gid] <= max_dist) for s, gid in zip(strain_num, self._id_list)]
+		for s, n in zip(strain_num, self._size_list):
+			output[s] += n
 		return output
 
 	#we need to work out depletion and neutralization 
 	def calc_neutralization( self, antigen_list ):
-		spec1_num = 0
-		spec2_num = 0
-		spec3_num = 0
-		spec4_num = 0        
-		for i in range(0, len(self._genotype_list)):
-			phenotype1 = GenePhenotype( self._genotype_list[i], self._antigen_list[0] )
-			phenotype2 = GenePhenotype( self._genotype_list[i], self._antigen_list[1] )
-			phenotype3 = GenePhenotype( self._genotype_list[i], self._antigen_list[2] )
-			phenotype4 = GenePhenotype( self._genotype_list[i], self._antigen_list[3] )
-			
-			if (phenotype1 <= max_dist):
-				spec1_num += self._size_list[i]*BindingAffinity_Pre(phenotype1, 2.5)
-			if (phenotype2 <= max_dist):
-				spec2_num += self._size_list[i]*BindingAffinity_Pre(phenotype2, 2.5)
-			if (phenotype3 <= max_dist):
-				spec3_num += self._size_list[i]*BindingAffinity_Pre(phenotype3, 2.5)
-			if (phenotype4 <= max_dist):
-				spec4_num += self._size_list[i]*BindingAffinity_Pre(phenotype4, 2.5)
-                
-		output = [spec1_num, spec2_num, spec3_num, spec4_num]
+		BA_table = [BindingAffinity_Pre(phenotype, 2.5) for phenotype in range(0, max_dist+1)]
+		output = []
+		for k in range(0, 4):
+			phenotype_list = self._registry.phenotype[self._antigen_list[k].ID()]
+			output.append( sum([n*BA_table[phenotype_list[gid]] for n, gid in zip(self._size_list, self._id_list) if phenotype_list[gid] <= max_dist]) )
 		return output
 
 	def calc_cross(self, antigen1, epitope):
@@ -807,166 +1063,623 @@ class BCell( Population ):
 		return pop
 
 	def calc_isotype( self ):
-		g_num = 0
-		for i in range(0, len(self._genotype_list)):
-			gene = self._genotype_list[i]
-			if (gene[isotype_position - 1] == 'G'):
-				g_num += self._size_list[i]
+		code = self._registry.code
+		g_num = sum([n for n, gid in zip(self._size_list, self._id_list) if code[gid] & 1])
 		m_num = self.size() - g_num
 		output = [m_num, g_num]
 		return output
         
-	#function for randomly generating the starting population of naive B cells
-	def generate_population( self, value):
-		for antigen in self._antigen_list:
+	#the starting naive repertoire: for every (antigen, epitope, phenotype 7-19) a quota of 
+	#candidates at that distance from the epitope, dropping those closer to any epitope, then 
+	#the (antigen, epitope, phenotype) buckets over quota are trimmed at random. Drawn on packed
+	#sequences, the rejected and trimmed candidates never enter the compartment, and the trim 
+	#visits only the buckets over quota. With NumPy generate_population_array draws it instead
+	def generate_population_batch( self, value ):
+		if (numpy is not None):
+			self.generate_population_array( value )
+			return
+		antigen_list = self._antigen_list
+		high_pop = int(math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))) * len(antigen_list) * 2
+		codes = []
+		members = {}		#bucket -> candidates, emptied lazily
+		counts = {}
+		shapes = {}		#the scores of the candidates, one shared tuple per pattern
+		quota = {}
+		for antigen in antigen_list:
 			n_epitope = len(antigen.epitope_all())
+			pop = int((math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))/n_epitope)/1.0)
 			for j in range(0, n_epitope):
-				for phenotype in range(7,8):
-					current_pop = 0
-					pop = int(math.floor(math.pow(10,-1*(5+max_dist-phenotype)) * float(value))/n_epitope)
-					while (current_pop < pop):
-						current_pop += 1
-						base_gene = GeneFromPhenotype( phenotype, antigen, j )
-						min_phen = 7
-						for k in range(0,len(self._antigen_list)):
-							phenotype1 = GenePhenotype( base_gene, self._antigen_list[k] )
-							if (phenotype1 < min_phen ):
-								min_phen = phenotype1 
-						if (min_phen == 7):
-							self.genotype_increase(base_gene, 1)
-#						print( base_gene )
-
-		high_pop = int(math.floor(math.pow(10,-1*(5+max_dist-phenotype)) * float(value))) * len(self._antigen_list) * 2
+				for phenotype in range(7,20):
+					quota[(antigen.ID(), j, phenotype)] = pop
+		for antigen in antigen_list:
+			n_epitope = len(antigen.epitope_all())
+			pop = int((math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))/n_epitope)/1.0)
+			for j in range(0, n_epitope):
+				epitope_code = antigen.epitope( j ).packed()
+				for phenotype in range(7,20):
+					for c in range(0, pop):
+						packed = SequenceFromPhenotype( phenotype, epitope_code )
+						scores = [SequencePhenotypeEpitope( packed, antigen_k ) for antigen_k in antigen_list]
+						dist = 999
+						epitope = 999
+						for score in scores:
+							if (score[0] < dist):
+								dist = score[0]
+								epitope = score[1]
+						if (dist < phenotype):
+							continue
+						keys = [(antigen_list[k].ID(), epitope, scores[k][0]) for k in range(0, len(scores))]
+						for key in keys:
+							members.setdefault( key, [] ).append( len(codes) )
+							counts[key] = counts.get( key, 0 ) + 1
+						shape = tuple([tuple(score) for score in scores])
+						codes.append( [packed << 1, keys, shapes.setdefault( shape, shape )] )
+
+		over = sorted([key for key in quota if counts.get( key, 0 ) > quota[key]])
 		for i in range(0, high_pop):
-			for antigen in self._antigen_list:
-				n_epitope = len(antigen.epitope_all())
-				for j in range(0, n_epitope):
-					for phenotype in range(7,8):
-						pop = int(math.floor(math.pow(10,-1*(5+max_dist-phenotype)) * float(value))/n_epitope)
-						subpopulation = self._subpopulation_master[ antigen.ID() ]
-						current_pop = subpopulation[j][phenotype]
-						if ( subpopulation[j][phenotype] > pop ):
-							del_gene = self.select_epitope_phenotype(j, phenotype, antigen.ID())
-							self.genotype_decrease( del_gene, 1)
-
-	def generate_population_new( self, value):
-		for antigen in self._antigen_list:
+			if (len(over) == 0):
+				break
+			for key in over:
+				if (counts[key] <= quota[key]):
+					continue
+				candidates = members[key]
+				while True:
+					r = random.randrange( len(candidates) )
+					c = candidates[r]
+					candidates[r] = candidates[-1]
+					candidates.pop()
+					if (codes[c][1] is not None):
+						break
+				for other in codes[c][1]:
+					counts[other] -= 1
+				codes[c][1] = None
+			over = [key for key in over if counts[key] > quota[key]]
+
+		self.add_candidates( [[code, scores] for code, keys, scores in codes if keys is not None] )
+
+	#generate_population_batch on NumPy arrays: the candidates are the rows of one symbol 
+	#matrix, scored by one candidate x epitope distance matrix. The quotas are met in one pass,
+	#a candidate is kept if it is within the quota of each of its buckets in a random order of
+	#the candidates (a bucket can end below quota when a candidate is cut by another of its 
+	#buckets, as with the trim)
+	def generate_population_array( self, value ):
+		antigen_list = self._antigen_list
+		rng = numpy.random.default_rng( random.getrandbits( 64 ) )
+		epitopes = []		#symbols of every epitope, antigen by antigen
+		first = [0]		#row in epitopes of the first epitope of each antigen, and the end
+		quota = []
+		rows = []		#epitope row, phenotype and number of candidates of each draw
+		for antigen in antigen_list:
 			n_epitope = len(antigen.epitope_all())
+			pop = int((math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))/n_epitope)/1.0)
+			quota.append( pop )
 			for j in range(0, n_epitope):
 				for phenotype in range(7,20):
-					current_pop = 0
-					pop = int((math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))/n_epitope)/1.0)
-					while (current_pop < pop):
-						current_pop += 1
-						base_gene = GeneFromPhenotype( phenotype, antigen, j )
-						min_phen = phenotype
-						for k in range(0,len(self._antigen_list)):
-							phenotype1 = GenePhenotype( base_gene, self._antigen_list[k] )
-							if (phenotype1 < min_phen ):
-								min_phen = phenotype1 
-						if (min_phen == phenotype):
-							self.genotype_increase(base_gene, 1)
-#							print(current_pop, base_gene )                   
-		high_pop = int(math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))) * len(self._antigen_list) * 2
-		for i in range(0, high_pop):        
-			for antigen in self._antigen_list:
-				n_epitope = len(antigen.epitope_all())
-				for j in range(0, n_epitope):
-					for phenotype in range(7,20):
-						pop = int((math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))/n_epitope)/1.0)
-						subpopulation = self._subpopulation_master[ antigen.ID() ]
-						current_pop = subpopulation[j][phenotype]
-						if ( subpopulation[j][phenotype] > pop ):
-							del_gene = self.select_epitope_phenotype(j, phenotype, antigen.ID())
-							self.genotype_decrease( del_gene, 1)
-                            
+					rows.append( [len(epitopes), phenotype, pop] )
+				epitopes.append( [int(x) - 1 for x in antigen.epitope( j ).get_sequence()[:gene_len]] )
+			first.append( len(epitopes) )
+		epitopes = numpy.array( epitopes, dtype=numpy.int64 )
+		counts = [x[2] for x in rows]
+		target = numpy.repeat( numpy.array( [x[0] for x in rows], dtype=numpy.int64 ), counts )
+		phenotype = numpy.repeat( numpy.array( [x[1] for x in rows], dtype=numpy.int64 ), counts )
+		n = len(target)
+		if (n == 0):
+			return
+
+		#phenotype random positions of the epitope changed to another symbol
+		changed = rng.random( (n, gene_len) ).argsort( axis=1 ).argsort( axis=1 ) < phenotype[:, None]
+		shift = rng.integers( 1, gene_vocab, size=(n, gene_len) )
+		candidates = (epitopes[target] + changed*shift) % gene_vocab
+
+		distance = numpy.empty( (n, len(epitopes)), dtype=numpy.int64 )
+		for e in range(0, len(epitopes)):
+			distance[:, e] = (candidates != epitopes[e]).sum( axis=1 )
+		n_antigen = len(antigen_list)
+		dist = numpy.empty( (n, n_antigen), dtype=numpy.int64 )
+		nearest = numpy.empty( (n, n_antigen), dtype=numpy.int64 )
+		for k in range(0, n_antigen):
+			nearest[:, k] = distance[:, first[k]:first[k+1]].argmin( axis=1 )
+			dist[:, k] = distance[numpy.arange( n ), first[k] + nearest[:, k]]
+		closest = dist.argmin( axis=1 )
+		epitope = nearest[numpy.arange( n ), closest]
+		keep = dist[numpy.arange( n ), closest] >= phenotype
+
+		order = rng.permutation( numpy.flatnonzero( keep ) )
+		for k in range(0, n_antigen):
+			group = (epitope*21 + dist[:, k])[order]
+			ranked = numpy.argsort( group, kind='stable' )
+			group = group[ranked]
+			start = numpy.ones( len(group), dtype=bool )
+			start[1:] = group[1:] != group[:-1]
+			position = numpy.arange( len(group) )
+			rank = numpy.empty( len(group), dtype=numpy.int64 )
+			rank[ranked] = position - numpy.maximum.accumulate( numpy.where( start, position, 0 ) )
+			unlimited = (dist[order, k] > 19) | (epitope[order] >= first[k+1] - first[k])
+			keep[order[(rank >= quota[k]) & ~unlimited]] = False
+		kept = numpy.flatnonzero( keep )
+
+		weights = numpy.array( [1 << (gene_bits*(gene_len - 1 - i)) for i in range(0, gene_len)], dtype=numpy.uint64 )
+		codes = (candidates[kept].astype( numpy.uint64 )*weights).sum( axis=1, dtype=numpy.uint64 ).tolist()
+		dist = dist[kept].tolist()
+		nearest = nearest[kept].tolist()
+		shapes = {}
+		output = []
+		for i in range(0, len(codes)):
+			shape = tuple([(dist[i][k], nearest[i][k]) for k in range(0, n_antigen)])
+			output.append( [codes[i] << 1, shapes.setdefault( shape, shape )] )
+		self.add_candidates( output )
+
+	#adds the naive cells drawn by generate_population_batch, [packed gene, [phenotype, 
+	#epitope] of each antigen] for every cell, without scoring them again
+	def add_candidates( self, candidates ):
+		sizes = {}
+		scored = {}
+		for code, scores in candidates:
+			sizes[code] = sizes.get( code, 0 ) + 1
+			scored[code] = scores
+		registry = self._registry
+		for code in sizes:
+			self.clone_increase( registry.intern_code( code, scored[code] ), sizes[code] )
+
+	#loads the repertoire of the seed from the cache, or draws it without moving the random 
+	#state of the run and stores it
+	def generate_population_seeded( self, value, seed ):
+		filename = None
+		if (repertoire_cache_dir is not None and value > 0):
+			filename = RepertoireCacheFile( self._antigen_list, value, seed )
+			if (os.path.exists( filename )):
+				self.load_population( filename )
+				return
+		state = random.getstate()
+		random.seed( seed )
+		self.generate_population_batch( value )
+		random.setstate( state )
+		if (filename is not None):
+			self.save_population( filename )
+
+	def save_population( self, filename ):
+		codes = array.array('Q', [self._registry.code[gid] for gid in self._id_list])
+		WriteRepertoire( filename, codes, array.array('q', self._size_list) )
+
+	#the packed genes go to the registry as they are, without unpacking them
+	def load_population( self, filename ):
+		codes, sizes = ReadRepertoire( filename )
+		registry = self._registry
+		for i in range(0, len(codes)):
+			self.clone_increase( registry.intern_code( codes[i] ), sizes[i] )
+
 	def return_gene_list( self ):
-		return self._genotype_list
+		return [self._registry.gene(gid) for gid in self._id_list]
+
+	#where the compartment keeps its genotypes
+	def registry_for( self, antigen_list ):
+		return GenotypeRegistryFor( antigen_list )
 
 	def return_size_list( self ):
 		return self._size_list
 
-	def __init__( self, name, value, antigen_list ):
+	#with a seed, the naive repertoire is drawn from its own random stream (so the same for 
+	#every run with that seed) and kept in the repertoire cache
+	def __init__( self, name, value, antigen_list, seed=None ):
 		Population.__init__( self, name, 0 )
 		Population.set_type(self, "bcell")
-		self._genotype_list = []
-		self._epitope_list = []
-		self._size_list = []
+		self._registry = self.registry_for( antigen_list )
+		self._registry.attach( self )
+		self._id_list = self.column( [] )	#registry id of each clone
+		self._size_list = self.column( [] )
+		self._index = self.slot_index()		#registry id -> slot in the lists above
+		self._clone_tree = FenwickTree( [], self._typecode )	#clone sizes by slot, for select_random
 		self._antigen_list = antigen_list
 		epitope_num = antigen_list[0].epitope_num()
 		
 		#for each antigen
-		self._phenotype_master = []
 		self._subpopulation_master = []
 		for antigen in antigen_list:	
-			phenotype_list = []
 			subpopulation = [[0]*20 for x in range(epitope_num)]
-			
-			self._phenotype_master.append(phenotype_list)	
 			self._subpopulation_master.append(subpopulation)
+		self._apparent = [[] for antigen in antigen_list]	#running apparent sizes of each antigen
+		self._apparent_index = {}
+		self.build_buckets()
 		
-		self.generate_population_new( value )
+		if (seed is None):
+			self.generate_population_batch( value )
+		else:
+			self.generate_population_seeded( value, seed )
             
+#Naive repertoire files: a header (magic, format, number of genotypes), the packed genes 
+#('Q') and their sizes ('q'), in native byte order. The name hashes every input of the 
+#repertoire, whether NumPy drew it and the format, which is to be bumped whenever the file layout or the draws of 
+#generate_population_batch change, so a cache of an older generator is never read
+repertoire_magic = 0x4E52455031		#"NREP1"
+repertoire_format = 3
+
+def RepertoireCacheFile( antigen_list, value, seed ):
+	epitopes = [[epitope.get_sequence() for epitope in antigen.epitope_all()] for antigen in antigen_list]
+	key = repr( [repertoire_format, epitopes, int(value), gene_len, gene_vocab, max_dist, seed, numpy is not None] )
+	return os.path.join( repertoire_cache_dir, "naive_" + hashlib.sha1( key.encode() ).hexdigest() + ".rep" )
+
+#written under a temporary name and renamed, so concurrent runs never read a partial file
+def WriteRepertoire( filename, codes, sizes ):
+	os.makedirs( os.path.dirname( filename ) or ".", exist_ok=True )
+	temp = filename + "." + str(os.getpid()) + ".tmp"
+	f = open( temp, "wb" )
+	f.write( array.array('Q', [repertoire_magic, repertoire_format, len(codes)]).tobytes() )
+	f.write( codes.tobytes() )
+	f.write( sizes.tobytes() )
+	f.close()
+	os.replace( temp, filename )
+
+#the packed genes and sizes of a repertoire file, [codes, sizes]
+def ReadRepertoire( filename ):
+	f = open( filename, "rb" )
+	data = f.read()
+	f.close()
+	header = array.array('Q')
+	if (len(data) >= 24):
+		header.frombytes( data[0:24] )
+	if (len(header) == 0 or header[0] != repertoire_magic or header[1] != repertoire_format or len(data) != 24 + 16*header[2]):
+		raise ValueError( "not a naive repertoire file: " + filename )
+	n = header[2]
+	codes = array.array('Q')
+	codes.frombytes( data[24:24+8*n] )
+	sizes = array.array('q')
+	sizes.frombytes( data[24+8*n:] )
+	return [codes, sizes]
+
+#Name: SlotIndex
+#Desc: The registry id -> slot map of a ColumnBCell, an array indexed by registry id (-1 for
+#      the ids the compartment does not hold) in place of a dict. It costs 8 bytes per 
+#      registry id up to the largest one held, against a dict entry and two ints per clone
+class SlotIndex:
+	__slots__ = ('_slot',)
+
+	def __init__( self ):
+		self._slot = array.array('l')
+
+	def __len__( self ):
+		return len(self._slot) - self._slot.count( -1 )
+
+	def get( self, gid, default=None ):
+		if (gid is None or gid >= len(self._slot) or self._slot[gid] < 0):
+			return default
+		return self._slot[gid]
+
+	def __getitem__( self, gid ):
+		i = self.get( gid )
+		if (i is None):
+			raise KeyError( gid )
+		return i
+
+	def __setitem__( self, gid, i ):
+		if (gid >= len(self._slot)):
+			self._slot.extend( array.array('l', [-1]) * max(gid + 1 - len(self._slot), len(self._slot)) )
+		self._slot[gid] = i
+
+	def __delitem__( self, gid ):
+		self._slot[gid] = -1
+
+#an ndarray over a typed array (a clone column or a registry array), without a copy. The
+#array cannot grow while it is viewed, so the views are only held within one reduction
+def ColumnView( column ):
+	return numpy.frombuffer( column, dtype=numpy.dtype(column.typecode) )
+
+#Name: ColumnBCell
+#Desc: A B cell population that keeps its clone ids and sizes, its clone trees and buckets
+#      and its id -> slot map in typed arrays instead of lists and dicts of Python ints. The
+#      clone statistics and the output reductions are computed with NumPy over the columns
+#      and the registry arrays (needs NumPy)
+class ColumnBCell( BCell ):
+
+	_typecode = 'q'
+
+	def __init__( self, name, value, antigen_list, seed=None ):
+		if (numpy is None):
+			raise ImportError( "ColumnBCell needs NumPy" )
+		BCell.__init__( self, name, value, antigen_list, seed )
+
+	def slot_index( self ):
+		return SlotIndex()
+
+	#the registry array values of every clone, by slot
+	def clone_values( self, values ):
+		return ColumnView( values )[ ColumnView( self._id_list ) ]
+
+	def phenotype_size( self, phenotype, antigenID ):
+		phenotype_list = self.clone_values( self._registry.phenotype[antigenID] )
+		return int(ColumnView( self._size_list )[phenotype_list == phenotype].sum())
+
+	def epitope_size( self, epitope ):
+		epitope_list = self.clone_values( self._registry.epitope )
+		return int(ColumnView( self._size_list )[epitope_list == epitope].sum())
+
+	def diversity( self, threshold ):
+		return int((ColumnView( self._size_list ) >= threshold).sum())
+
+	#the fewest clones, largest first, holding the threshold fraction of the cells
+	def diversity2( self, threshold ):
+		num = threshold * float(Population.size( self ))
+		sort_list = numpy.sort( ColumnView( self._size_list ) )[::-1]
+		before = numpy.cumsum( sort_list ) - sort_list
+		return int((before < num).sum())
+
+	def binding_mask( self ):
+		mask = numpy.zeros( len(self._id_list), dtype=numpy.int64 )
+		for k in range(0, len(self._antigen_list)):
+			phenotype_list = self.clone_values( self._registry.phenotype[self._antigen_list[k].ID()] )
+			mask |= (phenotype_list <= max_dist).astype( numpy.int64 ) << k
+		return mask
+
+	def calc_crossreactivity_specificity( self, antigen_list ):
+		mask = self.binding_mask() & 15
+		nearest = [self.clone_values( self._registry.nearest[self._antigen_list[k].ID()] ) for k in range(0, 4)]
+		#the epitope of the first antigen bound, which every other antigen bound must share
+		first = nearest[3]
+		for k in range(2, -1, -1):
+			first = numpy.where( (mask >> k) & 1, nearest[k], first )
+		same = (mask != 0) & (first < 4)
+		for k in range(0, 4):
+			same &= (((mask >> k) & 1) == 0) | (nearest[k] == first)
+		group = numpy.array( crossreactivity_group )[mask[same]]
+		output = numpy.bincount( 4*group + first[same], weights=ColumnView( self._size_list )[same], minlength=60 )
+		return [int(x) for x in output]
+
+	def calc_crossreactivity( self, antigen_list ):
+		group = numpy.array( crossreactivity_group )[self.binding_mask() & 15]
+		output = numpy.bincount( group, weights=ColumnView( self._size_list ), minlength=16 )
+		return [int(x) for x in output]
+
+	def calc_transcend( self, antigen_list ):
+		strain_num = numpy.zeros( len(self._id_list), dtype=numpy.int64 )
+		for j in range(0, len(antigen_list)-1):
+			strain_num += self.clone_values( self._registry.phenotype[self._antigen_list[j].ID()] ) <= max_dist
+		output = numpy.bincount( strain_num, weights=ColumnView( self._size_list ), minlength=len(antigen_list)+1 )
+		return [int(x) for x in output]
+
+	def calc_neutralization( self, antigen_list ):
+		BA_table = numpy.array( [BindingAffinity_Pre(phenotype, 2.5) for phenotype in range(0, max_dist+1)] )
+		sizes = ColumnView( self._size_list )
+		output = []
+		for k in range(0, 4):
+			phenotype_list = self.clone_values( self._registry.phenotype[self._antigen_list[k].ID()] )
+			binding = phenotype_list <= max_dist
+			output.append( float(numpy.dot( sizes[binding], BA_table[phenotype_list[binding]] )) )
+		return output
+
+	def calc_isotype( self ):
+		isotype = self.clone_values( self._registry.code ) & 1
+		g_num = int(ColumnView( self._size_list )[isotype == 1].sum())
+		return [self.size() - g_num, g_num]
+
+#Name: ImplicitBCell
+#Desc: A naive B cell population that only counts its cells by NaiveClassRegistry class,
+#      which is all the stimulation propensities and the output read. The gene of a cell is
+#      drawn, conditioned on its class, when the cell is selected to leave (Stimulation); 
+#      decay removes cells from the counts. The naive repertoire is counted by class as it is
+#      drawn, it is the repertoire BCell draws for the same seed. The clone statistics treat 
+#      each class as one clone: diversity, diversity2 and return_size_list count classes, and
+#      return_gene_list has one gene drawn from each class
+class ImplicitBCell( BCell ):
+
+	def __init__( self, name, value, antigen_list, seed=None ):
+		self._classes = NaiveClassRegistry( antigen_list, value )
+		BCell.__init__( self, name, value, antigen_list, seed )
+		self._classes.origin = 1	#every later cell comes from BCell.increase
+
+	def registry_for( self, antigen_list ):
+		return self._classes
+
+	#the cache holds genes, which only a BCell can write
+	def save_population( self, filename ):
+		pass
+
+	def add_candidates( self, candidates ):
+		classes = self._classes
+		sizes = {}
+		for code, scores in candidates:
+			key = classes.score_key( scores, code & 1, classes.origin )
+			sizes[key] = sizes.get( key, 0 ) + 1
+		for key in sizes:
+			self.clone_increase( classes.intern_key( key ), sizes[key] )
+
+	def return_gene_list( self ):
+		return [self._classes.draw( cid ) for cid in self._id_list]
+
+	#the gene of the cell taken is drawn from its class
+	def take_random_code( self ):
+		r = random.random()
+		total = self._clone_tree.total()
+		if (total <= 0):
+			print("ERROR: COULD NOT FIND RANDOM select random " + str(self.name()) )
+			return None
+		i = self._clone_tree.search( r*total )
+		code = GenePack( self._classes.draw( self._id_list[i] ) )
+		Population.decrease( self, 1 )
+		self.slot_decrease( i, 1 )
+		return code
+
+	def decrease( self, n ):
+		total = self._clone_tree.total()
+		if (total <= 0):
+			print("ERROR: COULD NOT FIND RANDOM select random " + str(self.name()) )
+			return
+		Population.decrease( self, 1 )
+		self.slot_decrease( self._clone_tree.search( random.random()*total ), 1 )
+
+#position of each binding pattern (bit k set when Antigen k is bound) in the
+#calc_crossreactivity output, grouped as in BCell.calc_crossreactivity
+crossreactivity_group = [15, 11, 12, 5, 13, 6, 8, 1, 14, 7, 9, 2, 10, 3, 4, 0]
+
 #########################################
 ## REACTIONS TYPES
 #########################################
 #Name: OrderZero
 #Desc: Defines the base class for zero-order reactions 
 class OrderZero:
+    __slots__ = ('_name', '_k')
+
     def __init__( self, name, k ):
         self._name = name
         self._k = ln2 * float( k )
-        self.__rate = 0
         
     def rate( self ):
-        self.__rate = self._k
-        return self.__rate
+        return self._k
+
+    #a new rate constant, e.g. scheduled on the engine between the phases of a protocol
+    def set_rate( self, k ):
+        self._k = ln2 * float( k )
+
+    def depends( self ):
+        return []
+
+    def react_many( self, k ):
+        for i in range(0, k):
+            self.react()
 
 #Name: OrderOne
 #Desc: Defines the base class for first-order reactions
 class OrderOne:
+    __slots__ = ('_name', '_k', 'A', '_A_size')
+
     def __init__( self, name, k, A ):
         self._name = name
         self._k = ln2*float(k)
-        self._A = A
+        self.A = A
+        self._A_size = A.size
 
     def rate( self ):
-        self.__rate = self._k * self._A.size()
-        return self.__rate
+        return self._k * self._A_size()
+
+    def set_rate( self, k ):
+        self._k = ln2*float(k)
+
+    def depends( self ):
+        return [self.A]
+
+    def react_many( self, k ):
+        for i in range(0, k):
+            self.react()
 
 #Name: OrderTwo
 #Desc: Defines the base class for second-order reactions
 class OrderTwo:
+	__slots__ = ('_name', '_k', 'A', 'B', '_A_size', '_B_size')
+
 	def __init__( self, name, k, A, B):
 		self._name = name
 		self._k = ln2*float(k)
-		self._A = A
-		self._B = B
+		self.A = A
+		self.B = B
+		self._A_size = A.size
+		self._B_size = B.size
 
 	def rate( self ):
-		self.__rate = self._k * self._A.size() * self._B.size()
-		return self.__rate
+		return self._k * self._A_size() * self._B_size()
+
+	def set_rate( self, k ):
+		self._k = ln2*float(k)
+
+	def depends( self ):
+		return [self.A, self.B]
+
+	def react_many( self, k ):
+		for i in range(0, k):
+			self.react()
 
 #Name: OrderTwoPhenotype
 #Desc: Defines the base class for second-order reactions where the reaction rate is the 
 #      result of a heterogenious population, with varying phenotypes (such as B cell stimulation)
 class OrderTwoPhenotype:  
+	__slots__ = ('_name', '_k', 'A', 'B', '_max_rate', '_aff_factor', '_type', '_select_k', '_select_max_rate',
+		'_A_size', '_A_antigen', '_B_size', '_apparent', '_apparent_antigen', '_weight_tables', '_cumulative', '_cumulative_key')
+
 	def __init__( self, name, k, A, B, max_rate, aff_factor, type ):
 		self._name = name
 		self._k = ln2*float(k)
-		self._A = A
-		self._B = B
+		self.A = A
+		self.B = B
 		self._max_rate = ln2*max_rate
 		self._aff_factor = aff_factor
-		BA.aff_value( aff_factor )
 		self._type = type
+		self._select_k = k			#unscaled constants of the selection weights
+		self._select_max_rate = max_rate
+		self._A_size = A.size
+		self._A_antigen = A.return_antigen
+		self._B_size = B.size
+		self._apparent = None		#B's ApparentSizeSum for the antigen of A
+		self._apparent_antigen = None
+		self._weight_tables = {}	#(antigen ID, antigen version) -> [epitope, phenotype, apparent weight, real weight] cells
+		self._cumulative = []		#cumulative selection weights of the cells
+		self._cumulative_key = None	#(antigen ID, antigen version, B version, agg_rate) they were computed for
+		self.weight_table( B._antigen_list[A.return_antigen().ID()] )
 
 	def rate( self ):
-		self.__rate = 0.0
-		if (self._B.size() > 0):
-			Bcell_app = self._B.ApparentSizeAll( self._aff_factor, self._type, self._A )
-			self.__rate = min(self._A.size() * Bcell_app * self._k, self._B.size() * self._max_rate)
-		return self.__rate
+		B_size = self._B_size()
+		if (B_size > 0):
+			antigen = self._A_antigen()
+			if (antigen is not self._apparent_antigen):
+				self._apparent = self.B.apparent_sum( antigen.ID(), self._aff_factor, self._type )
+				self._apparent_antigen = antigen
+			return min(self._A_size() * self._apparent.total * self._k, B_size * self._max_rate)
+		return 0.0
+
+	def depends( self ):
+		return [self.A, self.B]
+
+	#new rate constants, the selection weights are summed again on the next pick
+	def set_rate( self, k, max_rate ):
+		self._k = ln2*float(k)
+		self._max_rate = ln2*max_rate
+		self._select_k = k
+		self._select_max_rate = max_rate
+		self._cumulative_key = None
+
+	def react_many( self, k ):
+		for i in range(0, k):
+			self.react()
+
+	#the binding (epitope, phenotype) cells of an antigen with the per-cell apparent size and
+	#real size weights (the AffinityWeightTable entry and alpha)
+	def weight_table( self, antigen ):
+		table = self._weight_tables.get( (antigen.ID(), antigen._version) )
+		if (table is None):
+			weights = AffinityWeightTable( antigen, self._aff_factor, self._type )
+			table = []
+			for i in range(0, len(weights)):
+				alpha = EpitopeAlpha( antigen.epitope( i ), self._type )
+				for j in range(0, len(weights[i])):
+					if (weights[i][j] > 0.0):
+						table.append( [i, j, weights[i][j], alpha] )
+			for key in [key for key in self._weight_tables if key[0] == antigen.ID()]:
+				del self._weight_tables[key]
+			self._weight_tables[ (antigen.ID(), antigen._version) ] = table
+		return table
+
+	#picks a B cell with the weights min(apparent size*agg_rate, real size*max_rate) of the
+	#(epitope, phenotype) cells, which are summed once and kept until B or the antigen changes.
+	#the antigen is B's entry for the ID of A's, as read by rate() through B.apparent_sum
+	def select_weighted( self ):
+		antigen = self.B._antigen_list[self._A_antigen().ID()]
+		agg_rate = self._select_k * self._A_size()
+		max_rate = self._select_max_rate
+		key = (antigen.ID(), antigen._version, self.B._version, agg_rate)
+		table = self.weight_table( antigen )
+		if (key != self._cumulative_key):
+			subpopulation = self.B.subpopulation( antigen.ID() )
+			total = 0.0
+			self._cumulative = []
+			for cell in table:
+				n = subpopulation[cell[0]][cell[1]]
+				total += min(n*cell[2]*agg_rate, n*cell[3]*max_rate)
+				self._cumulative.append( total )
+			self._cumulative_key = key
+
+		r = random.random()
+		if (len(self._cumulative) == 0 or self._cumulative[-1] <= 0.0):
+			print("ERROR PHENOTYPE/EPITOPE NOT SELECTED IN REACT")
+			return None
+		i = min(bisect.bisect_right( self._cumulative, r*self._cumulative[-1] ), len(self._cumulative) - 1)
+		cell = table[i]
+		return self.B.select_epitope_phenotype( cell[0], cell[1], antigen.ID() )
 
 #########################################
 ## IMMUNE SYSTEM REACTIONS 
@@ -975,51 +1688,74 @@ class OrderTwoPhenotype:
 #Desc: Defines the reaction for B cell stimulation
 #		i.e. 	B + Ag -> B* + Ag 
 class Stimulation( OrderTwoPhenotype ):
+	__slots__ = ('C',)
+
 	def __init__( self, name, k, A, B, C, max_rate, aff_factor, type ):
 		OrderTwoPhenotype.__init__(self, name, k, A, B, max_rate, aff_factor, type)
-		self.A = A
-		self.B = B
 		self.C = C
-		self.aff_factor = aff_factor
-		self.type = type
-		self.max_rate = max_rate
-		self.k = k
 
 	def react( self ):
-		antigen = self.A.return_antigen()
-		agg_rate = self.k * self.A.size()
-		base_gene = self.B.select_random_weighted( self.aff_factor, self.max_rate, self.type, agg_rate, antigen )
+		base_gene = self.select_weighted()
 
 		self.B.genotype_decrease(base_gene, 1 )
 		self.C.genotype_increase(base_gene, 1 )
 
+	#k stimulations against the same antigen load (the rate is frozen over a leap)
+	def react_many( self, k ):
+		for i in range(0, k):
+			if (self.rate() <= 0.0):
+				break
+			base_gene = self.select_weighted()
+			self.B.genotype_decrease(base_gene, 1 )
+			self.C.genotype_increase(base_gene, 1 )
+
+	def stoichiometry( self ):
+		return [[self.B, -1], [self.C, 1]]
+
+	#only the B cells binding the antigen can be stimulated within a leap
+	def leap_limit( self ):
+		return self.B.binding_size( self.A.return_antigen().ID() )
+
 class MStimulation( OrderTwoPhenotype ):
+	__slots__ = ('C', 'D')
+
 	def __init__( self, name, k, A, B, C, D, max_rate, aff_factor, type ):
 		OrderTwoPhenotype.__init__(self, name, k, A, B, max_rate, aff_factor, type)
-		self.A = A
-		self.B = B
 		self.C = C
 		self.D = D    
-		self.aff_factor = aff_factor
-		self.type = type
-		self.max_rate = max_rate
-		self.k = k
 
 	def react( self ):
-		antigen = self.A.return_antigen()
-		agg_rate = self.k * self.A.size()
-		base_gene = self.B.select_random_weighted( self.aff_factor, self.max_rate, self.type, agg_rate, antigen )
+		base_gene = self.select_weighted()
 
 		self.B.genotype_decrease(base_gene, 1 )
 		if (random.random() < 0.975):        
 		    self.C.genotype_increase(base_gene, 1 )
 		else:
 		    self.D.genotype_increase(base_gene, 1 )        
+
+	def react_many( self, k ):
+		for i in range(0, k):
+			if (self.rate() <= 0.0):
+				break
+			base_gene = self.select_weighted()
+			self.B.genotype_decrease(base_gene, 1 )
+			if (random.random() < 0.975):
+				self.C.genotype_increase(base_gene, 1 )
+			else:
+				self.D.genotype_increase(base_gene, 1 )
+
+	def stoichiometry( self ):
+		return [[self.B, -1], [self.C, 0.975], [self.D, 0.025]]
+
+	def leap_limit( self ):
+		return self.B.binding_size( self.A.return_antigen().ID() )
         
 #Name: Formation
 #Desc: Defines the spontaneous formation of a B cell
 #		i.e.	0 -> B
 class Formation( OrderZero ):
+	__slots__ = ('A',)
+
 	def __init__( self, name, k, A ):
 		OrderZero.__init__(self, name, k)
 		self.A = A
@@ -1027,32 +1763,76 @@ class Formation( OrderZero ):
 	def react( self ):
 		self.A.increase( 1 )
 
+	#every new B cell is a new random genotype, drawn in one batch
+	def react_many( self, k ):
+		if (isinstance(self.A, BCell)):
+			self.A.increase_many( k )
+		else:
+			self.A.increase( k )
+
+	def stoichiometry( self ):
+		return [[self.A, 1]]
+
+	#[probability, [[population, change]]] of each outcome of a firing, for the engines 
+	#that apply the firings of count populations to arrays (ReplicateReaction)
+	def outcomes( self ):
+		return [[1.0, [[self.A, 1]]]]
+
 #Name: Decay
 #Desc: Define the first order decay of many components, such as antigen, antibodies, plasma cells
 #		i.e.	Ag -> 0
 class Decay( OrderOne ):
+	__slots__ = ()
+
 	def __init__( self, name, k, A ):
-		self.A = A
 		OrderOne.__init__(self, name, k, A)
 
 	def react( self ):
 		self.A.decrease( 1 )
 
+	#k cells of a B cell compartment are removed by size in one pass
+	def react_many( self, k ):
+		if (isinstance(self.A, BCell)):
+			self.A.remove_random( k )
+		else:
+			self.A.decrease( k )
+
+	def stoichiometry( self ):
+		return [[self.A, -1]]
+
+	def outcomes( self ):
+		return [[1.0, [[self.A, -1]]]]
 
 #Name: Viral replication
 #Desc: Define the first order replication of viral particles
 class Replication( OrderOne ):
+	__slots__ = ()
+
 	def __init__( self, name, k, A ):
-		self.A = A
 		OrderOne.__init__(self, name, k, A)
 
 	def react( self ):
 		self.A.increase( 1 )
 
+	def react_many( self, k ):
+		if (isinstance(self.A, BCell)):
+			OrderOne.react_many( self, k )
+		else:
+			self.A.increase( k )
+
+	def stoichiometry( self ):
+		return [[self.A, 1]]
+
+	def outcomes( self ):
+		return [[1.0, [[self.A, 1]]]]
+
 #Name: PopulationDecay
 #Desc: Defines the first order decay of a population under a carrying capacity, for example GC B cells
 #		i.e. B -> 0 
 class PopulationDecay:
+	__slots__ = ('name', 'r', 'k', 'A', 'B', 'C', 'D', 'capacity', '_A_size')
+	skips_empty = True		#react() leaves empty populations alone
+
 	def __init__( self, name, r, k, capacity, A, B, C, D):
 		self.name = name
 		self.r = r			#replication rate
@@ -1062,16 +1842,25 @@ class PopulationDecay:
 		self.C = C
 		self.D = D
 		self.capacity = float(capacity) 	#carrying capacity
-		self.__rate = 0
+		self._A_size = A.size
 
 	def rate( self ):
-		self.__rate = 0
-		population_size = float(self.A.size())
+		population_size = float(self._A_size())
 		k_adjust = self.r * (population_size/self.capacity)
 		k = max(self.k, k_adjust)
 
-		self.__rate = k * population_size
-		return self.__rate
+		return k * population_size
+
+	def set_rate( self, r, k ):
+		self.r = r
+		self.k = k
+
+	def depends( self ):
+		return [self.A]
+
+	def react_many( self, k ):
+		for i in range(0, k):
+			self.react()
 
 	def react( self ):
 		i = random.random()
@@ -1084,10 +1873,16 @@ class PopulationDecay:
 		else:
 			if (self.D.size() > 0):
 				self.D.decrease(1)
+
+	def stoichiometry( self ):
+		return [[self.B, -0.33], [self.C, -0.33], [self.D, -0.34]]
                 
 #Name: TPopulationDecay
 #Desc: Defines the first order decay of a population under a carrying capacity
 class TPopulationDecay:
+	__slots__ = ('name', 'r', 'k', 'A', 'B', 'capacity', '_A_size')
+	skips_empty = True		#react() leaves empty populations alone
+
 	def __init__( self, name, r, k, capacity, A, B):
 		self.name = name
 		self.r = r			#replication rate
@@ -1095,21 +1890,39 @@ class TPopulationDecay:
 		self.A = A
 		self.B = B
 		self.capacity = float(capacity) 	#carrying capacity
-		self.__rate = 0
+		self._A_size = A.size
 
 	def rate( self ):
-		self.__rate = 0
-		population_size = float(self.A.size())
+		population_size = float(self._A_size())
 		k_adjust = self.r * (population_size/self.capacity)
 		k = max(self.k, k_adjust)
 
-		self.__rate = k * population_size
-		return self.__rate
+		return k * population_size
+
+	def set_rate( self, r, k ):
+		self.r = r
+		self.k = k
+
+	def depends( self ):
+		return [self.A]
 
 	def react( self ):
 		if (self.B.size() > 0):
 			self.B.decrease(1)
 
+	def react_many( self, k ):
+		if (isinstance(self.B, BCell)):
+			for i in range(0, k):
+				self.react()
+		else:
+			self.B.decrease( min(k, self.B.size()) )
+
+	def stoichiometry( self ):
+		return [[self.B, -1]]
+
+	def outcomes( self ):
+		return [[1.0, [[self.B, -1]]]]
+
 #Name: Differentiation 
 #Desc: Defines the first order reaction of differentiation into one of three components, for example 
 #      a stimulated B cell can divide into a daughter B cell, memory cell, or plasma cell.
@@ -1118,9 +1931,10 @@ class TPopulationDecay:
 #		       -> B + Me
 #              -> B + Pl 
 class Differentiation( OrderOne ):
+	__slots__ = ('B', 'C', 'D', 'E', 'F', 'max_rate')
+
 	def __init__( self, name, k, A, B, C, D, E, F, max_rate ):
 		OrderOne.__init__(self, name, k, A)
-		self.A = A
 		self.B = B
 		self.C = C
 		self.D = D
@@ -1128,99 +1942,127 @@ class Differentiation( OrderOne ):
 		self.F = F   
 		self.max_rate = max_rate
 
+	#the daughters are mutated and switched on the packed gene of the parent
 	def react( self ):
-		gene_A = self.A.select_random()
-		self.A.genotype_decrease(gene_A, 1)
+		code_A = self.A.take_random_code()
+		if (code_A is None):
+			return
 
 		iso_rate = isotype_rate
 		mut_rate = (mutation_rate + mutation_rate/gene_vocab) * (1-lethal_fraction)
 		diff_rate = differentiation_rate
 
 		for i in range(2):
-			new_gene = gene_A
+			new_code = code_A
 			r = random.random()
 			if ( r <= iso_rate ):
-				new_gene = IsotypeSwitch( gene_A )
-				self.B.genotype_increase(new_gene, 1)
+				new_code = IsotypeSwitchPacked( code_A )
+				self.B.code_increase(new_code, 1)
 			elif ( r <= mut_rate+iso_rate ): 
-				new_gene = GeneMutate( new_gene )
-				self.B.genotype_increase(new_gene, 1)
+				new_code = GeneMutatePacked( new_code )
+				self.B.code_increase(new_code, 1)
 			elif ( r <= mut_rate+iso_rate+reverse_rate): 
-				self.C.genotype_increase(new_gene, 1)
+				self.C.code_increase(new_code, 1)
 			elif (r <= mut_rate+iso_rate+reverse_rate+diff_rate):
 				if(random.random() < 0.2):
-					self.D.genotype_increase(gene_A, 1)
+					self.D.code_increase(code_A, 1)
 				else:
 				    s = random.random()
 				    if(s < 0.975):
-					    self.E.genotype_increase(gene_A, 1)
+					    self.E.code_increase(code_A, 1)
 				    else:
-					    self.F.genotype_increase(gene_A, 1)                        
+					    self.F.code_increase(code_A, 1)                        
 			else:
-				self.B.genotype_increase(new_gene, 1)
+				self.B.code_increase(new_code, 1)
+
+	#expected change per division, each of the two daughters is drawn as in react()
+	def stoichiometry( self ):
+		mut_rate = (mutation_rate + mutation_rate/gene_vocab) * (1-lethal_fraction)
+		to_B = min(1.0, isotype_rate + mut_rate)
+		to_C = min(1.0, isotype_rate + mut_rate + reverse_rate) - to_B
+		to_diff = min(1.0, isotype_rate + mut_rate + reverse_rate + differentiation_rate) - to_B - to_C
+		to_B += 1.0 - to_B - to_C - to_diff
+		return [[self.A, -1], [self.B, 2*to_B], [self.C, 2*to_C], [self.D, 2*to_diff*0.2],
+			[self.E, 2*to_diff*0.8*0.975], [self.F, 2*to_diff*0.8*0.025]]
 
 class BDifferentiation( OrderOne ):
+	__slots__ = ('B', 'max_rate')
+
 	def __init__( self, name, k, A, B, max_rate ):
 		OrderOne.__init__(self, name, k, A)
-		self.A = A
 		self.B = B      
 		self.max_rate = max_rate
 
 	def react( self ):
-		gene_A = self.A.select_random()
-		self.A.genotype_decrease(gene_A, 1)
+		code_A = self.A.take_random_code()
+		if (code_A is None):
+			return
 
 		iso_rate = isotype_rate
 		mut_rate = (mutation_rate + mutation_rate/gene_vocab) * (1-lethal_fraction)
 		diff_rate = differentiation_rate
 
 		for i in range(2):
-			new_gene = gene_A
+			new_code = code_A
 			r = random.random()
 			if ( r <= iso_rate ):
-				new_gene = IsotypeSwitch( gene_A )
-				self.B.genotype_increase(new_gene, 1)
+				new_code = IsotypeSwitchPacked( code_A )
+				self.B.code_increase(new_code, 1)
 			elif ( r <= mut_rate+iso_rate ): 
-				new_gene = GeneMutate( new_gene )
-				self.B.genotype_increase(new_gene, 1)                       
+				new_code = GeneMutatePacked( new_code )
+				self.B.code_increase(new_code, 1)                       
 			else:
-				self.B.genotype_increase(new_gene, 1)
+				self.B.code_increase(new_code, 1)
+
+	def stoichiometry( self ):
+		return [[self.A, -1], [self.B, 2]]
 			
 #Name: Production
 #Desc: Defines the first order production of one component by another component
 #      for example plasma cells producing antibodies.
 #	i.e. Pl -> Pl + Ab
 class Production( OrderOne ):
+	__slots__ = ('B',)
+
 	def __init__( self, name, k, A, B ):
 		OrderOne.__init__(self, name, k, A)
-		self.A = A
 		self.B = B
 
 	def react( self ):
 		base_gene = self.A.select_random()
 		self.B.genotype_increase(base_gene, 1)
 
+	#the producers of k firings are drawn together, and each producing clone adds its cells once
+	def react_many( self, k ):
+		self.B.receive( self.A, self.A.sample_slots( k ) )
+
+	def stoichiometry( self ):
+		return [[self.B, 1]]
+
 
 class LLPCProduction( OrderTwo ):
+	__slots__ = ('C',)
+
 	def __init__( self, name, k, A, B, C):
 		OrderTwo.__init__(self, name, k, A, B)
-		self.A = A
-		self.B = B
 		self.C = C
 
 	def react( self ):
 		base_gene = self.B.select_random()
 		self.C.genotype_increase(base_gene, 1 )
 
+	def stoichiometry( self ):
+		return [[self.C, 1]]
+
 #Name: Clearance
 #Desc: Defines the second order clearance of one component by another component
 #      through Ab/BCR binding. For example antibody-based clearance of an antigen
 #	i.e. Ab + Ag -> Ab 
 class AbClearance( OrderTwoPhenotype ):
+	__slots__ = ('AbClearcount',)
+
 	def __init__( self, name, k, A, B, max_rate, aff_factor, type, AbClearcount):
 		OrderTwoPhenotype.__init__(self, name, k, A, B, max_rate, aff_factor, type)
-		self.A = A
-		self.B = B
 		self.AbClearcount = AbClearcount
         
 	def react( self ):
@@ -1234,28 +2076,46 @@ class AbClearance( OrderTwoPhenotype ):
 #			for i in range(30):           
 #				base_gene = self.B.select_random()
 #				self.B.genotype_decrease(base_gene, 1 )
+
+	def react_many( self, k ):
+		if (self.B.size() > 900):
+			self.A.decrease(k)
+			self.AbClearcount.increase(k)
+
+	def stoichiometry( self ):
+		return [[self.A, -1], [self.AbClearcount, 1]]
         
 #Name: Clearance
 #Desc: Defines the second order viral clearance by CD8 T-cell
 class TClearance( OrderTwo):
+	__slots__ = ('T8Clearcount',)
+
 	def __init__( self, name, k, A, B, T8Clearcount):
 		OrderTwo.__init__(self, name, k, A, B)
-		self.A = A
-		self.B = B
 		self.T8Clearcount = T8Clearcount
         
 	def react( self ):
 		self.A.decrease(1)
 		self.T8Clearcount.increase(1)
 
+	def react_many( self, k ):
+		self.A.decrease(k)
+		self.T8Clearcount.increase(k)
+
+	def stoichiometry( self ):
+		return [[self.A, -1], [self.T8Clearcount, 1]]
+
+	def outcomes( self ):
+		return [[1.0, [[self.A, -1], [self.T8Clearcount, 1]]]]
+
         
 #Name: Stimulation of B cell by T cell
 #Desc: Defines the second order reaction
 class TStimulation( OrderTwo ):
+	__slots__ = ('C', 'D')
+
 	def __init__( self, name, k, A, B, C, D ):
 		OrderTwo.__init__(self, name, k, A, B)
-		self.A = A
-		self.B = B
 		self.C = C
 		self.D = D
         
@@ -1266,27 +2126,41 @@ class TStimulation( OrderTwo ):
 		self.C.genotype_increase(base_gene, 1)
 		self.D.increase(1)
 
+	def stoichiometry( self ):
+		return [[self.A, -1], [self.B, -1], [self.C, 1], [self.D, 1]]
+
 #Name: Stimulation of CD8 T cell by CD4 stimulated T cell
 #Desc: Defines the second order reaction
 class T8Stimulation( OrderTwo ):
+	__slots__ = ('C',)
+
 	def __init__( self, name, k, A, B, C):
 		OrderTwo.__init__(self, name, k, A, B)
-		self.A = A
-		self.B = B
 		self.C = C
         
 	def react( self ):
 		self.B.decrease(1)    
 		self.C.increase(1)
+
+	def react_many( self, k ):
+		self.B.decrease(k)
+		self.C.increase(k)
+
+	def stoichiometry( self ):
+		return [[self.B, -1], [self.C, 1]]
+
+	def outcomes( self ):
+		return [[1.0, [[self.B, -1], [self.C, 1]]]]
         
 #Name: TCD4 Differentiation by Mutation
 #Name: TCD4 Differentiation into memory 
 #Desc: Define the first order reaction
 
 class TDifferentiation( OrderOne ):
+	__slots__ = ('B', 'C')
+
 	def __init__( self, name, k, A, B, C):
 		OrderOne.__init__(self, name, k, A)
-		self.A = A
 		self.B = B
 		self.C = C
 
@@ -1302,32 +2176,527 @@ class TDifferentiation( OrderOne ):
 		else:
 			self.C.increase(1)
 
+	#the k outcomes are split multinomially (0.025, 0.875, 0.1)
+	def react_many( self, k ):
+		n_double = BinomialRandom(k, 0.025)
+		n_single = BinomialRandom(k - n_double, 0.875/0.975)
+		self.A.decrease(k)
+		self.B.increase(2*n_double + n_single)
+		self.C.increase(k - n_double - n_single)
+
+	def stoichiometry( self ):
+		return [[self.A, -1], [self.B, 0.925], [self.C, 0.1]]
+
+	def outcomes( self ):
+		return [[0.025, [[self.A, -1], [self.B, 2]]], [0.875, [[self.A, -1], [self.B, 1]]], [0.1, [[self.A, -1], [self.C, 1]]]]
+
 #Name: TCD4 Differentiation by Mutation
 #Name: TCD4 Differentiation into memory 
 #Desc: Define the first order reaction
 
 class T8Differentiation( OrderOne ):
+	__slots__ = ('B',)
+
 	def __init__( self, name, k, A, B):
 		OrderOne.__init__(self, name, k, A)
-		self.A = A
 		self.B = B
 
 	def react( self ):
 		self.A.decrease(1)        
 		self.B.increase(2)
+
+	def react_many( self, k ):
+		self.A.decrease(k)
+		self.B.increase(2*k)
+
+	def stoichiometry( self ):
+		return [[self.A, -1], [self.B, 2]]
+
+	def outcomes( self ):
+		return [[1.0, [[self.A, -1], [self.B, 2]]]]
             
 #########################################
 ## SYSTEM FUNCTIONS 
 #########################################
+#Name: SumTree
+#Desc: Complete binary tree over a fixed number of non-negative values (reaction rates),
+#      where every internal node holds the sum of its two children. A value is changed 
+#      in O(log n) and a value is selected with probability proportional to its size by 
+#      a O(log n) descent from the root. The parents are re-summed from their children,
+#      so the total does not accumulate rounding drift
+class SumTree:
+    def __init__( self, values ):
+        self._n = len(values)
+        self._size = 1
+        while (self._size < self._n):
+            self._size *= 2
+        self._node = [0.0]*(2*self._size)
+        for i in range(0, self._n):
+            self._node[self._size + i] = values[i]
+        for h in range(self._size - 1, 0, -1):
+            self._node[h] = self._node[2*h] + self._node[2*h + 1]
+
+    def total( self ):
+        return self._node[1]
+
+    def value( self, i ):
+        return self._node[self._size + i]
+
+    def update( self, i, value ):
+        node = self._node
+        h = self._size + i
+        node[h] = value
+        h = h//2
+        while (h >= 1):
+            node[h] = node[2*h] + node[2*h + 1]
+            h = h//2
+
+    #returns the first index whose cumulative sum exceeds target (0 <= target < total)
+    def search( self, target ):
+        node = self._node
+        h = 1
+        while (h < self._size):
+            h = 2*h
+            if (target >= node[h]):
+                target -= node[h]
+                h += 1
+        i = h - self._size
+        #rounding can push the descent onto an empty leaf, fall back to the nearest positive
+        #rate below it, or else to the last positive rate
+        if (i >= self._n or node[h] <= 0.0):
+            i = min(i, self._n - 1)
+            while (i > 0 and node[self._size + i] <= 0.0):
+                i -= 1
+            if (node[self._size + i] <= 0.0):
+                i = self._n - 1
+                while (i > 0 and node[self._size + i] <= 0.0):
+                    i -= 1
+        return i
+
+#Name: FenwickTree
+#Desc: Binary indexed tree over non-negative counts (clone sizes). A count is changed and a
+#      prefix sum is found in O(log n), and an index is sampled with probability proportional
+#      to its count by a O(log n) descent. Counts can be appended and popped at the end
+class FenwickTree:
+    __slots__ = ('_n', '_node')
+
+    def __init__( self, values, typecode=None ):
+        self._n = len(values)
+        self._node = [0] + list(values)
+        if (typecode is not None):
+            self._node = array.array(typecode, self._node)
+        for i in range(1, self._n + 1):
+            parent = i + (i & -i)
+            if (parent <= self._n):
+                self._node[parent] += self._node[i]
+
+    def __len__( self ):
+        return self._n
+
+    def add( self, i, delta ):
+        node = self._node
+        i += 1
+        while (i <= self._n):
+            node[i] += delta
+            i += i & -i
+
+    #sum of the first i counts
+    def prefix( self, i ):
+        node = self._node
+        total = 0
+        while (i > 0):
+            total += node[i]
+            i -= i & -i
+        return total
+
+    def total( self ):
+        return self.prefix( self._n )
+
+    def value( self, i ):
+        return self.prefix( i + 1 ) - self.prefix( i )
+
+    def append( self, value ):
+        i = self._n + 1
+        self._node.append( value + self.prefix(i - 1) - self.prefix(i - (i & -i)) )
+        self._n = i
+
+    def pop( self ):
+        self._node.pop()
+        self._n -= 1
+
+    #returns the first index whose cumulative count exceeds target (0 <= target < total)
+    def search( self, target ):
+        node = self._node
+        i = 0
+        step = 1
+        while (2*step <= self._n):
+            step *= 2
+        while (step > 0):
+            if (i + step <= self._n and node[i + step] <= target):
+                i += step
+                target -= node[i]
+            step //= 2
+        return min(i, self._n - 1)
+
+#Name: CloneBucket
+#Desc: The clones of a BCell compartment sharing one (epitope, phenotype) for an antigen. 
+#      Holds their slots with a FenwickTree over their sizes, so a clone of the bucket is
+#      sampled by size in O(log n). Members are removed by moving the last one into the gap
+class CloneBucket:
+    __slots__ = ('slots', 'tree')
+
+    def __init__( self, typecode=None ):
+        self.slots = []
+        self.tree = FenwickTree( [], typecode )
+        if (typecode is not None):
+            self.slots = array.array(typecode)
+
+    #returns the position of the new member
+    def add( self, slot, n ):
+        self.slots.append( slot )
+        self.tree.append( n )
+        return len(self.slots) - 1
+
+    #returns the slot moved into position pos, or None
+    def remove( self, pos ):
+        last = len(self.slots) - 1
+        moved = None
+        if (pos != last):
+            self.tree.add( pos, self.tree.value(last) - self.tree.value(pos) )
+            self.slots[pos] = self.slots[last]
+            moved = self.slots[pos]
+        self.slots.pop()
+        self.tree.pop()
+        return moved
+
+    def sample( self, r ):
+        return self.slots[ self.tree.search( r*self.tree.total() ) ]
+
+#Name: ApparentSizeSum
+#Desc: The apparent size of a BCell compartment for one (antigen, aff_factor, type), the
+#      sum of its (epitope, phenotype) counts weighted by binding affinity and alpha. The
+#      compartment changes it by the delta of every count, and it is reset exactly to zero
+#      once no counted cell is left, so rounding cannot leave a rate on an empty compartment
+class ApparentSizeSum:
+    __slots__ = ('weights', 'total', 'count')
+
+    def __init__( self, weights, subpopulation ):
+        self.weights = weights          #[epitope][phenotype], phenotypes beyond the list weigh 0
+        self.build( subpopulation )
+
+    def build( self, subpopulation ):
+        self.total = 0.0
+        self.count = 0
+        for i in range(0, len(self.weights)):
+            for j in range(0, len(self.weights[i])):
+                if (self.weights[i][j] > 0.0):
+                    self.total += subpopulation[i][j] * self.weights[i][j]
+                    self.count += subpopulation[i][j]
+
+    def change( self, epitope, phenotype, n ):
+        weights = self.weights[epitope]
+        if (phenotype < len(weights) and weights[phenotype] > 0.0):
+            self.count += n
+            if (self.count == 0):
+                self.total = 0.0
+            else:
+                self.total += n * weights[phenotype]
+
+#Name: GenotypeRegistry
+#Desc: The genotypes of every BCell compartment of a simulation. Each unique gene is 
+#      registered once under an integer id, with its closest epitope over all antigens and 
+#      its phenotype (and closest epitope) for each antigen, so a clone moving between 
+#      compartments is never re-scored. Compartments count their references to an id, and 
+#      the ids nobody holds are swept and reused once they outnumber the live ones.
+#      When an epitope changes (EpitopeChanged) every gene is scored again and the attached
+#      compartments re-sort their clones
+class GenotypeRegistry:
+    __slots__ = ('_antigen_list', '_id', '_free', '_dead', '_compartments', 'code', 'epitope', 'phenotype', 'nearest', 'refs', '__weakref__')
+
+    def __init__( self, antigen_list ):
+        self._antigen_list = antigen_list
+        self._id = {}                   #packed gene -> id
+        self._free = []                 #swept ids, reused before new ones
+        self._dead = 0                  #registered ids held by no compartment
+        self._compartments = weakref.WeakSet()     #compartments holding ids of the registry
+        self.code = array.array('Q')    #packed gene of each id
+        self.epitope = array.array('l') #closest epitope over all antigens
+        self.phenotype = [array.array('l') for antigen in antigen_list]    #[antigenID][id]
+        self.nearest = [array.array('l') for antigen in antigen_list]      #closest epitope of each antigen
+        self.refs = array.array('l')
+        scored_registries.add( self )
+
+    def __len__( self ):
+        return len(self._id)
+
+    def attach( self, compartment ):
+        self._compartments.add( compartment )
+
+    #whether the genes are scored against an Epitope or AntigenType
+    def scores( self, changed ):
+        for antigen in self._antigen_list:
+            if (antigen is changed or len([x for x in antigen.epitope_all() if x is changed]) > 0):
+                return True
+        return False
+
+    #scores every registered gene against the current epitopes, then has the compartments
+    #re-sort their clones. Skipped while the antigens are being refilled (an antigen without
+    #epitopes, or with fewer than the others), the change completing it rescores
+    def rescore( self ):
+        epitope_num = [antigen.epitope_num() for antigen in self._antigen_list]
+        if (min(epitope_num) == 0 or min(epitope_num) != max(epitope_num)):
+            return
+        for code, gid in self._id.items():
+            packed = code >> 1
+            dist = 999
+            for k in range(0, len(self._antigen_list)):
+                score = SequencePhenotypeEpitope( packed, self._antigen_list[k] )
+                self.phenotype[k][gid] = score[0]
+                self.nearest[k][gid] = score[1]
+                if (score[0] < dist):
+                    dist = score[0]
+                    self.epitope[gid] = score[1]
+        for compartment in list(self._compartments):
+            compartment.rescore()
+
+    def lookup( self, gene ):
+        return self._id.get( GenePack( gene ) )
+
+    #id of a gene, registering it if it is new
+    def intern( self, gene ):
+        return self.intern_code( GenePack( gene ) )
+
+    #id of a packed gene, registering it if it is new. scores, the [phenotype, epitope] of
+    #each antigen, can be given when they are known
+    def intern_code( self, code, scores=None ):
+        gid = self._id.get( code )
+        if (gid is not None):
+            return gid
+
+        if (scores is None):
+            scores = [phenotype_cache.phenotype_epitope( code >> 1, antigen ) for antigen in self._antigen_list]
+        dist = 999
+        epitope = 999
+        for phenotype in scores:
+            if (phenotype[0] < dist):
+                dist = phenotype[0]
+                epitope = phenotype[1]
+
+        if (len(self._free) > 0):
+            gid = self._free.pop()
+            self.code[gid] = code
+            self.epitope[gid] = epitope
+            for k in range(0, len(scores)):
+                self.phenotype[k][gid] = scores[k][0]
+                self.nearest[k][gid] = scores[k][1]
+        else:
+            gid = len(self.code)
+            self.code.append( code )
+            self.epitope.append( epitope )
+            for k in range(0, len(scores)):
+                self.phenotype[k].append( scores[k][0] )
+                self.nearest[k].append( scores[k][1] )
+            self.refs.append( 0 )
+        self._id[code] = gid
+        self._dead += 1
+        return gid
+
+    def gene( self, gid ):
+        return GeneUnpack( self.code[gid] )
+
+    def retain( self, gid ):
+        if (self.refs[gid] == 0):
+            self._dead -= 1
+        self.refs[gid] += 1
+
+    def release( self, gid ):
+        self.refs[gid] -= 1
+        if (self.refs[gid] == 0):
+            self._dead += 1
+            if (self._dead > 4096 and 2*self._dead > len(self._id)):
+                self.sweep()
+
+    #forgets the genes no compartment holds, their ids are handed out again
+    def sweep( self ):
+        for code in [code for code, gid in self._id.items() if self.refs[gid] == 0]:
+            self._free.append( self._id.pop( code ) )
+        self._dead = 0
+
+#Name: NaiveClassRegistry
+#Desc: The genotype classes of an ImplicitBCell. A class is every gene with the same origin,
+#      isotype, closest epitope over all antigens, and phenotype and closest epitope for each
+#      antigen, which is all a compartment reads of a gene. A gene is only drawn when a cell 
+#      of its class leaves the compartment, from the recipe of its origin (0: the naive 
+#      repertoire of generate_population_batch, 1: BCell.increase) conditioned on the class.
+#      The classes hold no genes to score again, so they cannot follow an epitope change
+class NaiveClassRegistry:
+    __slots__ = ('_antigen_list', '_id', '_keys', '_drawn', '_quota', 'origin', 'draws', 'code', 'epitope', 'phenotype', 'nearest', '__weakref__')
+
+    def __init__( self, antigen_list, value ):
+        self._antigen_list = antigen_list
+        self._id = {}                   #class key -> id
+        self._keys = []
+        self._drawn = {}                #drawn gene -> class, until the cell is removed
+        self._quota = [int((math.floor(math.pow(10,-1*(5+max_dist-7.0)) * float(value))/antigen.epitope_num())/1.0) for antigen in antigen_list]
+        self.origin = 0                 #origin of the genes added
+        self.draws = 0                  #candidate sequences drawn for the genes handed out
+        self.code = array.array('Q')    #isotype bit of each class
+        self.epitope = array.array('l')
+        self.phenotype = [array.array('l') for antigen in antigen_list]
+        self.nearest = [array.array('l') for antigen in antigen_list]
+        scored_registries.add( self )
+
+    def __len__( self ):
+        return len(self._id)
+
+    def attach( self, compartment ):
+        pass
+
+    def scores( self, changed ):
+        return GenotypeRegistry.scores( self, changed )
+
+    def rescore( self ):
+        raise ValueError( "the classes of an ImplicitBCell cannot follow an epitope change, use a BCell naive compartment" )
+
+    def key( self, packed, isotype, origin ):
+        scores = [phenotype_cache.phenotype_epitope( packed, antigen ) for antigen in self._antigen_list]
+        return self.score_key( scores, isotype, origin )
+
+    #the class of a sequence with the given [phenotype, epitope] of each antigen
+    def score_key( self, scores, isotype, origin ):
+        dist = 999
+        epitope = 999
+        for score in scores:
+            if (score[0] < dist):
+                dist = score[0]
+                epitope = score[1]
+        return (origin, isotype, epitope, tuple([score[0] for score in scores]), tuple([score[1] for score in scores]))
+
+    #the class of a gene handed out by gene(), or of a gene of the current origin. Classes
+    #of different origins are never mixed
+    def lookup( self, gene ):
+        cid = self._drawn.pop( gene, None )
+        if (cid is not None):
+            return cid
+        return self._id.get( self.key( SequencePack( gene ), GenePack( gene ) & 1, self.origin ) )
+
+    def intern( self, gene ):
+        return self.intern_code( GenePack( gene ) )
+
+    def intern_code( self, code, scores=None ):
+        if (scores is None):
+            return self.intern_key( self.key( code >> 1, code & 1, self.origin ) )
+        return self.intern_key( self.score_key( scores, code & 1, self.origin ) )
+
+    def intern_key( self, key ):
+        cid = self._id.get( key )
+        if (cid is None):
+            cid = len(self._keys)
+            self._id[key] = cid
+            self._keys.append( key )
+            self.code.append( key[1] )
+            self.epitope.append( key[2] )
+            for k in range(0, len(self._antigen_list)):
+                self.phenotype[k].append( key[3][k] )
+                self.nearest[k].append( key[4][k] )
+        return cid
+
+    #a gene of the class, which lookup() maps back to the class until the cell is removed
+    def gene( self, cid ):
+        gene = self.draw( cid )
+        self._drawn[gene] = cid
+        return gene
+
+    #a gene of the class, by rejection from the recipe of its origin
+    def draw( self, cid ):
+        key = self._keys[cid]
+        antigen_list = self._antigen_list
+        while True:
+            if (key[0] == 0):
+                #the candidates of every (antigen, epitope) at the lowest phenotype of the class
+                phenotype = min(key[3])
+                r = random.random() * sum([self._quota[k] * antigen_list[k].epitope_num() for k in range(0, len(antigen_list))])
+                k = 0
+                while (k < len(antigen_list) - 1 and r >= self._quota[k] * antigen_list[k].epitope_num()):
+                    r -= self._quota[k] * antigen_list[k].epitope_num()
+                    k += 1
+                j = min(int(r / self._quota[k]), antigen_list[k].epitope_num() - 1)
+            else:
+                phenotype = random.randint( 7, gene_len )
+                k = random.randrange( len(antigen_list) )
+                j = random.randrange( antigen_list[k].epitope_num() )
+            #recipes that cannot give the class are rejected before drawing: the gene is 
+            #at distance phenotype from epitope j of antigen k
+            if (phenotype < key[3][k] or (phenotype == key[3][k] and j < key[4][k])):
+                continue
+            self.draws += 1
+            packed = SequenceFromPhenotype( phenotype, antigen_list[k].epitope( j ).packed() )
+            if (self.match( packed, key )):
+                return GeneUnpack( (packed << 1) | key[1] )
+
+    #whether a packed sequence is of the class, stopping at the first antigen that differs
+    def match( self, packed, key ):
+        dist = 999
+        epitope = 999
+        for k in range(0, len(self._antigen_list)):
+            score = SequencePhenotypeEpitope( packed, self._antigen_list[k] )
+            if (score[0] != key[3][k] or score[1] != key[4][k]):
+                return False
+            if (score[0] < dist):
+                dist = score[0]
+                epitope = score[1]
+        return epitope == key[2]
+
+    def retain( self, cid ):
+        pass
+
+    def release( self, cid ):
+        pass
+
+#shared registries, one per list of antigens (by identity, the registry follows their
+#epitope changes). Held weakly, a registry lives as long as the compartments holding it
+registries = weakref.WeakValueDictionary()
+
+#the GenotypeRegistry of the compartments scored against antigen_list
+def GenotypeRegistryFor( antigen_list ):
+    key = tuple([id(antigen) for antigen in antigen_list])
+    registry = registries.get( key )
+    if (registry is None):
+        registry = GenotypeRegistry( antigen_list )
+        registries[key] = registry
+    return registry
+
 #Name: TotalReaction
 #Desc: Contains the entire set of immune reactions that define the system. Calculates
-#      the reaction rate and Monte Carlo time step based on the Gillespie algorithm
+#      the reaction rate and Monte Carlo time step based on the Gillespie algorithm.
+#      A population -> reaction dependency graph is built from each reaction's depends(),
+#      so after an event only the rates reading a changed population are recalculated
+#      (changes are detected through the population version counters, which also
+#      catches populations changed by the run scripts between steps). The rates are
+#      kept in a SumTree, so updating a rate and selecting the next reaction are O(log R).
+#      Interventions (antigen doses, antigen changes) can be scheduled at exact times and
+#      are applied by advance() without rebuilding the reactions
 class TotalReaction:
     def __init__( self ):
         self.reaction_list = []
         self.n = 0
-        self.__rate = []
-        self.__total_rate = float(0.0)
+        self._rate = []
+        self._tree = SumTree( [] )
+        self._watch = []        #populations read by the reactions (GroupPopulations expanded)
+        self._seen = []         #last version of each watched population
+        self._readers = []      #for each watched population, the reactions reading it
+        self._always = []       #reactions without depends(), recalculated every step
+        self._species = []      #populations changed by the reactions
+        self._change = []       #for each reaction, [species index, change per firing] pairs
+        self._built = False
+        self.horizon = float('inf')     #longest step the approximate engines may take
+        self._schedule = []     #pending interventions, (time, order, action, args)
+        self._scheduled = 0
+        self.fast_forward = False       #sample pure Formation/Decay intervals directly
+        self.accelerator = None         #engine used while the populations in _quiet are empty
+        self.log_quiescence = False
+        self._quiet = []
+        self._impure = 0        #reaction that last ruled out a pure Formation/Decay interval
         
     def __len__(self):
         return len(self.reaction_list)       
@@ -1335,40 +2704,1182 @@ class TotalReaction:
     def add_reaction( self, reaction ):
         self.reaction_list.append( reaction )
         self.n = len(self.reaction_list)
+        self._built = False
 
     def remove_reaction( self, reaction ):
         self.reaction_list.remove( reaction )
         self.n = len(self.reaction_list)
+        self._built = False
+
+    def build_graph( self ):
+        index = {}
+        self._watch = []
+        self._readers = []
+        self._always = []
+        for i in range(0, self.n):
+            reaction = self.reaction_list[i]
+            if (not hasattr(reaction, 'depends')):
+                self._always.append(i)
+                continue
+            for pop in reaction.depends():
+                for member in pop.members():
+                    key = id(member)
+                    if (key not in index):
+                        index[key] = len(self._watch)
+                        self._watch.append(member)
+                        self._readers.append([])
+                    readers = self._readers[index[key]]
+                    if (i not in readers):
+                        readers.append(i)
+
+        #expected change of every population per firing, used by the approximate engines
+        index = {}
+        self._species = []
+        self._change = []
+        for reaction in self.reaction_list:
+            if (not hasattr(reaction, 'stoichiometry')):
+                self._change.append( None )
+                continue
+            change = []
+            for pop, v in reaction.stoichiometry():
+                key = id(pop)
+                if (key not in index):
+                    index[key] = len(self._species)
+                    self._species.append( pop )
+                change.append( [index[key], v] )
+            self._change.append( change )
+        self._built = True
         
     def rate( self ):
-        self.__rate = []
+        if (not self._built):
+            self.build_graph()
+        self._seen = [pop._version for pop in self._watch]
+        self._rate = []
         for i in range(0,self.n):
-            self.__rate.append( self.reaction_list[i].rate() )
-        self.__total_rate = sum( self.__rate )
+            self._rate.append( self.reaction_list[i].rate() )
+        self._tree = SumTree( self._rate )
+
+    def changed( self ):
+        stale = {}
+        seen = self._seen
+        watch = self._watch
+        for j in range(0, len(watch)):
+            version = watch[j]._version
+            if (version != seen[j]):
+                seen[j] = version
+                for i in self._readers[j]:
+                    stale[i] = 1
+        for i in self._always:
+            stale[i] = 1
+        return stale
+
+    def update( self ):
+        if (not self._built):
+            self.rate()
+            return
+        rate = self._rate
+        tree = self._tree
+        reaction_list = self.reaction_list
+        for i in self.changed():
+            rate[i] = reaction_list[i].rate()
+            tree.update( i, rate[i] )
         
     def MC_TimeStep( self ):
         r = random.random()
-        self.rate()
-        if (self.__total_rate > 0.0):
-            dt = (1/self.__total_rate)*math.log(1/r)
+        self.update()
+        total_rate = self._tree.total()
+        if (total_rate > 0.0):
+            dt = (1/total_rate)*math.log(1/r)
             return dt        
         else:
             return 0.0
             
     def MC_React( self ):
         r = random.random()
-#       self.rate()
+        total_rate = self._tree.total()
+        if (total_rate > 0.0):
+            self.reaction_list[ self._tree.search( r*total_rate ) ].react()
+            return 1
+        return 0
+
+    #the step returned by MC_TimeStep is not taken, the clock moves by dt without an event
+    #(exact for the direct method, the waiting time is memoryless)
+    def MC_Discard( self, dt ):
+        pass
+
+    #[population, [[reaction, rate] forming cells], decay rate per cell] of every target of 
+    #Formation/Decay (and of Production from a population that does not change) if these are
+    #the only reactions that can fire, otherwise None. a reaction with zero rate stays at zero
+    #while one of the populations it reads is empty and not formed, and a reaction that only
+    #removes cells from such populations has no effect
+    def birth_death( self ):
+        self.update()
+        rate = self._rate
+        reaction_list = self.reaction_list
+        if (self._impure < self.n and self.blocks( self._impure )):
+            return None
+        index = {}
+        processes = []
+        sources = []
+        idle = []
+        inert = []
+        for i in range(0, self.n):
+            reaction = reaction_list[i]
+            if (isinstance(reaction, (Formation, Decay)) or (isinstance(reaction, Production) and rate[i] > 0.0)):
+                target = reaction.A
+                if (isinstance(reaction, Production)):
+                    target = reaction.B
+                    sources.append(i)
+                key = id(target)
+                if (key not in index):
+                    index[key] = len(processes)
+                    processes.append( [target, [], 0.0] )
+                if (isinstance(reaction, Decay)):
+                    processes[index[key]][2] += reaction._k
+                elif (rate[i] > 0.0):
+                    processes[index[key]][1].append( [reaction, rate[i]] )
+            elif (rate[i] > 0.0 and hasattr(reaction, 'stoichiometry')):
+                inert.append(i)
+            elif (rate[i] > 0.0 or not hasattr(reaction, 'depends')):
+                self._impure = i
+                return None
+            else:
+                idle.append(i)
+        for i in sources:
+            for member in reaction_list[i].A.members():
+                if (id(member) in index):
+                    self._impure = i
+                    return None
+        #populations that are empty and stay empty
+        empty = {}
+        for i in idle + inert:
+            for pop in reaction_list[i].depends():
+                for member in pop.members():
+                    key = id(member)
+                    if (member.size() == 0 and (key not in index or len(processes[index[key]][1]) == 0)):
+                        empty[key] = 1
+        for i in idle:
+            frozen = 0
+            for pop in reaction_list[i].depends():
+                for member in pop.members():
+                    if (id(member) in empty):
+                        frozen = 1
+            if (frozen == 0):
+                self._impure = i
+                return None
+        for i in inert:
+            for pop, v in reaction_list[i].stoichiometry():
+                if (v >= 0 or id(pop) not in empty):
+                    self._impure = i
+                    return None
+        return processes
+
+    #cheap recheck of the reaction that stopped the last birth_death() scan, true while it
+    #still stops it: it fires (a Production from a population that changes), or it reads (idle)
+    #or removes from (inert) populations that hold cells. false when the full scan is needed
+    def blocks( self, j ):
+        reaction = self.reaction_list[j]
+        if (isinstance(reaction, (Formation, Decay))):
+            return False
+        if (isinstance(reaction, Production)):
+            return (self._rate[j] > 0.0)
+        if (self._rate[j] > 0.0):
+            if (not hasattr(reaction, 'stoichiometry')):
+                return True
+            for pop, v in reaction.stoichiometry():
+                if (v >= 0 or pop.size() > 0):
+                    return True
+            return False
+        if (not hasattr(reaction, 'depends')):
+            return True
+        for pop in reaction.depends():
+            for member in pop.members():
+                if (member.size() == 0):
+                    return False
+        return True
+
+    #samples the end state of independent immigration-death processes after dt: the cells
+    #present survive with probability exp(-mu*dt) and Poisson(lambda/mu*(1-exp(-mu*dt)))
+    #of the cells formed meanwhile by each source are still alive (every new B cell is a new
+    #genotype, a produced cell copies the genotype of a random producer)
+    def birth_death_jump( self, processes, dt ):
+        for pop, births, death in processes:
+            if (len(births) == 0 and pop.size() == 0):
+                continue
+            p = 1.0
+            if (death > 0.0):
+                p = math.exp(-death*dt)
+            if (isinstance(pop, BCell)):
+                pop.thin( p )
+            else:
+                pop.decrease( pop.size() - BinomialRandom(pop.size(), p) )
+            for reaction, birth in births:
+                mean = birth*dt
+                if (death > 0.0):
+                    mean = (birth/death)*(1.0 - p)
+                reaction.react_many( PoissonRandom(mean) )
+
+    #action(*args) is called by advance() at exactly the given simulation time, e.g.
+    #schedule( t, V0.increase, 25 ) or schedule( t, V0.change_antigen, antigen )
+    def schedule( self, t, action, *args ):
+        self._schedule.append( (t, self._scheduled, action, args) )
+        self._schedule.sort()
+        self._scheduled += 1
+
+    #while all the given populations (antigens and GC compartments) are empty, advance() runs
+    #the simulation with the accelerator engine (an adaptive TauLeaping by default) on the 
+    #same reactions. with log set, every accelerated interval is printed
+    def set_quiescent( self, populations, accelerator=None, log=False ):
+        if (accelerator is None):
+            accelerator = TauLeaping()
+        self._quiet = populations
+        self.accelerator = accelerator
+        self.log_quiescence = log
+
+    def quiescent( self ):
+        if (self.accelerator is None):
+            return False
+        for pop in self._quiet:
+            if (pop.size() != 0):
+                return False
+        return True
+
+    #runs the simulation from t to exactly t_end, applying the scheduled interventions on the
+    #way (one falling on t_end is left to the next call). observer(time) is called at each of
+    #the obs_times within (t, t_end], or after every step if no obs_times are given. with
+    #fast_forward set, pure Formation/Decay intervals are sampled in one jump per observation.
+    #returns the number of steps, reaction firings, interventions, jumps, the simulated time
+    #run by the accelerator and the wall time
+    def advance( self, t, t_end, observer=None, obs_times=None ):
+        start = time.time()
+        steps = 0
+        events = 0
+        interventions = 0
+        jumps = 0
+        accelerated = 0.0
+        obs = []
+        if (observer is not None and obs_times is not None):
+            obs = [x for x in obs_times if (x > t and x <= t_end)]
+            obs.sort()
+        k = 0
+        engine = self
+        since = t
+        while (True):
+            while (len(self._schedule) > 0 and self._schedule[0][0] <= t and self._schedule[0][0] < t_end):
+                event = self._schedule.pop(0)
+                event[2]( *event[3] )
+                interventions += 1
+                #an intervention may change rate constants as well as populations
+                self._built = False
+            if (t >= t_end):
+                break
+            t_stop = t_end
+            if (len(self._schedule) > 0 and self._schedule[0][0] < t_end):
+                t_stop = self._schedule[0][0]
+            while (t < t_stop):
+                remaining = t_stop - t
+                if (self.accelerator is not None):
+                    quiet = self.quiescent()
+                    if (quiet and engine is self):
+                        engine = self.accelerator
+                        engine.reaction_list = self.reaction_list
+                        engine.n = self.n
+                        engine._built = False
+                        since = t
+                    elif (not quiet and engine is not self):
+                        self.end_quiescence( since, t )
+                        engine = self
+                processes = None
+                if (self.fast_forward):
+                    processes = self.birth_death()
+                if (processes is not None):
+                    t_jump = t_stop
+                    if (k < len(obs) and obs[k] < t_stop):
+                        t_jump = obs[k]
+                    self.birth_death_jump( processes, t_jump - t )
+                    engine.MC_Discard( t_jump - t )
+                    self._built = False
+                    engine._built = False
+                    t = t_jump
+                    jumps += 1
+                    while (k < len(obs) and obs[k] <= t):
+                        observer( obs[k] )
+                        k += 1
+                    if (observer is not None and obs_times is None):
+                        observer( t )
+                    continue
+                engine.horizon = remaining
+                dt = engine.MC_TimeStep()
+                if (dt <= 0.0 or dt > remaining):
+                    engine.MC_Discard( remaining )
+                    if (engine is not self):
+                        accelerated += remaining
+                    t = t_stop
+                    break
+                while (k < len(obs) and obs[k] < t + dt):
+                    observer( obs[k] )
+                    k += 1
+                if (engine is not self):
+                    accelerated += dt
+                if (dt == remaining):
+                    t = t_stop
+                else:
+                    t += dt
+                events += engine.MC_React()
+                steps += 1
+                if (observer is not None and obs_times is None):
+                    observer( t )
+            while (k < len(obs) and obs[k] <= t):
+                observer( obs[k] )
+                k += 1
+        if (engine is not self):
+            self.end_quiescence( since, t )
+        self.horizon = float('inf')
+        stats = {}
+        stats['t'] = t
+        stats['steps'] = steps
+        stats['events'] = events
+        stats['interventions'] = interventions
+        stats['jumps'] = jumps
+        stats['accelerated'] = accelerated
+        stats['wall_time'] = time.time() - start
+        return stats
+
+    #the rates of the exact engine are stale after an accelerated interval
+    def end_quiescence( self, since, t ):
+        self.accelerator.horizon = float('inf')
+        self._built = False
+        if (self.log_quiescence):
+            print( "Accelerated quiescent interval " + str(since) + " - " + str(t) )
+
+#Name: SortingDirect
+#Desc: Sorting direct method (McCollum et al., Comput Biol Chem 2006). A drop in replacement
+#      for TotalReaction that selects the next reaction by a linear cumulative search 
+#      instead of the SumTree. Every reaction counts how often it fired, and every
+#      sort_interval events the search order is re-sorted so the most frequent reactions
+#      come first. The counts are halved at each sort, so the order follows the changing
+#      event mix of the phases (formation/decay during equilibration, replication,
+#      production and stimulation during infection). reaction_list itself is not reordered
+class SortingDirect( TotalReaction ):
+    def __init__( self, sort_interval=1000 ):
+        TotalReaction.__init__( self )
+        self.sort_interval = sort_interval
+        self._order = []        #reaction indices in search order
+        self._count = []        #decayed number of firings of every reaction
+        self._total = 0.0
+        self._peak = 0.0        #largest running total since the last re-summation
+        self._updates = 0
+        self.resync_interval = 10000    #full re-summation of the total rate
+        self._fired = 0         #events since the last sort
 
-        outcome = float( 0.0 )
-        
+    def rate( self ):
+        if (not self._built):
+            self.build_graph()
+        self._seen = [pop._version for pop in self._watch]
+        self._rate = []
         for i in range(0,self.n):
-            if (self.__total_rate > 0.0): 
-                outcome += (self.__rate[i]/self.__total_rate)
-            else: 
-                outcome += 0.0
-            if (r <= outcome):
-                self.reaction_list[i].react()
+            self._rate.append( self.reaction_list[i].rate() )
+        if (len(self._order) != self.n):
+            self._order = list(range(0, self.n))
+            self._count = [0.0]*self.n
+            self._fired = 0
+        self.resum()
+
+    def resum( self ):
+        self._total = sum( self._rate )
+        self._peak = self._total
+        self._updates = 0
+
+    #the running total carries the rounding error of the largest rates it held, so it is
+    #re-summed every resync_interval rate changes and whenever it falls near zero or far
+    #below its peak
+    def update( self ):
+        if (not self._built or len(self._order) != self.n):
+            self.rate()
+            return
+        rate = self._rate
+        reaction_list = self.reaction_list
+        for i in self.changed():
+            new_rate = reaction_list[i].rate()
+            self._total += new_rate - rate[i]
+            rate[i] = new_rate
+            self._updates += 1
+        if (self._total > self._peak):
+            self._peak = self._total
+        if (self._updates >= self.resync_interval or self._total < 1e-9 or self._total < 1e-6*self._peak):
+            self.resum()
+
+    def sort( self ):
+        count = self._count
+        self._order.sort( key=lambda i: -count[i] )
+        for i in range(0, self.n):
+            count[i] *= 0.5
+        self._fired = 0
+        self.resum()
+
+    def MC_TimeStep( self ):
+        r = random.random()
+        self.update()
+        if (self._total > 0.0):
+            return (1/self._total)*math.log(1/r)
+        return 0.0
+
+    def MC_React( self ):
+        r = random.random()
+        if (self._total <= 0.0):
+            return 0
+        rate = self._rate
+        target = r*self._total
+        i = -1
+        for j in self._order:
+            if (rate[j] > 0.0):
+                i = j
+                target -= rate[j]
+                if (target < 0.0):
+                    break
+        if (i < 0):
+            return 0
+        self.reaction_list[i].react()
+        self._count[i] += 1
+        self._fired += 1
+        if (self._fired >= self.sort_interval):
+            self.sort()
+        return 1
+
+#Name: IndexedPriorityQueue
+#Desc: Binary min-heap of reaction indices keyed by their putative firing times. The
+#      position of every reaction in the heap is indexed, so the key of any reaction can
+#      be changed in O(log R)
+class IndexedPriorityQueue:
+    def __init__( self, keys ):
+        self._key = list(keys)
+        self._heap = list(range(0, len(self._key)))
+        self._pos = list(range(0, len(self._key)))
+        for i in range(len(self._heap)//2 - 1, -1, -1):
+            self._sift_down(i)
+
+    def __len__( self ):
+        return len(self._heap)
+
+    def top( self ):
+        return self._heap[0]
+
+    def top_key( self ):
+        return self._key[self._heap[0]]
+
+    def key( self, i ):
+        return self._key[i]
+
+    def update( self, i, key ):
+        old_key = self._key[i]
+        self._key[i] = key
+        if (key < old_key):
+            self._sift_up(self._pos[i])
+        elif (key > old_key):
+            self._sift_down(self._pos[i])
+
+    def _swap( self, a, b ):
+        heap = self._heap
+        heap[a], heap[b] = heap[b], heap[a]
+        self._pos[heap[a]] = a
+        self._pos[heap[b]] = b
+
+    def _sift_up( self, h ):
+        heap = self._heap
+        key = self._key
+        while (h > 0):
+            parent = (h - 1)//2
+            if (key[heap[h]] < key[heap[parent]]):
+                self._swap(h, parent)
+                h = parent
+            else:
+                break
+
+    def _sift_down( self, h ):
+        heap = self._heap
+        key = self._key
+        n = len(heap)
+        while (True):
+            child = 2*h + 1
+            if (child >= n):
+                break
+            if (child + 1 < n and key[heap[child+1]] < key[heap[child]]):
+                child += 1
+            if (key[heap[child]] < key[heap[h]]):
+                self._swap(h, child)
+                h = child
+            else:
+                break
+
+#Name: NextReaction
+#Desc: Gibson-Bruck Next Reaction Method. Takes the same reactions as TotalReaction and
+#      is a drop in replacement for it (MC_TimeStep/MC_React). Every reaction keeps an 
+#      absolute putative firing time in an IndexedPriorityQueue. Only the reaction that 
+#      fired draws a new random number, the times of the reactions whose rate changed are 
+#      rescaled, so an event costs O(log R) heap updates for its dependent reactions
+class NextReaction( TotalReaction ):
+    def __init__( self ):
+        TotalReaction.__init__( self )
+        self._t = 0.0           #internal clock, the sum of the returned time steps
+        self._residual = []     #remaining unit exponential of reactions with zero rate
+        self._queue = None
+        self._fired = -1
+
+    def putative_time( self, i, residual ):
+        if (self._rate[i] > 0.0):
+            return self._t + residual/self._rate[i]
+        self._residual[i] = residual
+        return float('inf')
+
+    def rate( self ):
+        TotalReaction.rate( self )
+        self._residual = [0.0]*self.n
+        times = []
+        for i in range(0, self.n):
+            times.append( self.putative_time(i, random.expovariate(1.0)) )
+        self._queue = IndexedPriorityQueue( times )
+        self._fired = -1
+
+    def update( self ):
+        if (not self._built or self._queue is None):
+            self.rate()
+            return
+        rate = self._rate
+        queue = self._queue
+        stale = self.changed()
+        fired = self._fired
+        if (fired >= 0):
+            stale[fired] = 1
+        for i in stale:
+            old_rate = rate[i]
+            rate[i] = self.reaction_list[i].rate()
+            if (i == fired):
+                residual = random.expovariate(1.0)
+            elif (old_rate > 0.0):
+                residual = old_rate*(queue.key(i) - self._t)
+            else:
+                residual = self._residual[i]
+            queue.update( i, self.putative_time(i, residual) )
+        self._fired = -1
+
+    def MC_TimeStep( self ):
+        self.update()
+        if (self.n == 0 or self._queue.top_key() == float('inf')):
+            return 0.0
+        return self._queue.top_key() - self._t
+
+    def MC_React( self ):
+        if (self.n == 0 or self._queue.top_key() == float('inf')):
+            return 0
+        i = self._queue.top()
+        self._t = self._queue.top_key()
+        self._fired = i
+        self.reaction_list[i].react()
+        return 1
+
+    #the putative times are absolute, so skipping ahead only moves the clock
+    def MC_Discard( self, dt ):
+        self._t += dt
+
+#Name: TauLeaping
+#Desc: Adaptive tau-leaping (Cao, Gillespie & Petzold, J Chem Phys 2006) on the same reactions
+#      as TotalReaction. The leap is chosen so the expected relative change of every population
+#      stays below epsilon (using the stoichiometry() of the reactions). Reactions that could
+#      exhaust a reactant within n_critical firings are critical and fire at most once per leap;
+#      the others fire a Poisson number of times, or a binomial number bounded by the reactant
+#      count when they consume a population, through react_many(). Populations that a reaction
+#      leaves alone while they are empty (skips_empty) neither limit nor are consumed by it.
+#      A leap that would still drive a population negative is halved and redrawn (genotype 
+#      selective reactions also bound their firings by leap_limit()). When the leap would be shorter than 
+#      ssa_factor exact steps, ssa_steps exact Gillespie steps are taken instead.
+class TauLeaping( TotalReaction ):
+    def __init__( self, epsilon=0.03, n_critical=10, ssa_factor=10.0, ssa_steps=100 ):
+        TotalReaction.__init__( self )
+        self.epsilon = epsilon
+        self.n_critical = n_critical
+        self.ssa_factor = ssa_factor
+        self.ssa_steps = ssa_steps
+        self._ssa_left = 0
+        self._leap = None       #[reaction index, firings] of the pending leap, None for an exact step
+        self.leaps = 0
+        self.exact_steps = 0
+
+    #expected change of reaction j per firing over the leap. the populations a reaction
+    #leaves alone when they are empty (skips_empty) are not consumed while empty
+    def leap_change( self, j, x ):
+        change = self._change[j]
+        if (change is None or not getattr(self.reaction_list[j], 'skips_empty', False)):
+            return change
+        return [[i, v] for i, v in change if (v >= 0 or x[i] > 0)]
+
+    #number of firings of reaction j before one of its reactants is exhausted
+    def firing_limit( self, j, x ):
+        change = self.leap_change(j, x)
+        if (change is None):
+            return 0
+        limit = float('inf')
+        for i, v in change:
+            if (v < 0):
+                limit = min(limit, int(x[i]/max(1.0, -v)))
+        if (hasattr(self.reaction_list[j], 'leap_limit')):
+            limit = min(limit, self.reaction_list[j].leap_limit())
+        return limit
+
+    def exact_step( self ):
+        self._leap = None
+        self.exact_steps += 1
+        return TotalReaction.MC_TimeStep( self )
+
+    def MC_TimeStep( self ):
+        if (self._ssa_left > 0):
+            self._ssa_left -= 1
+            return self.exact_step()
+
+        self.update()
+        rate = self._rate
+        a0 = self._tree.total()
+        if (a0 <= 0.0):
+            self._leap = None
+            return 0.0
+
+        x = [pop.size() for pop in self._species]
+        mu = [0.0]*len(x)
+        sigma2 = [0.0]*len(x)
+        limits = [0]*self.n
+        critical = []
+        for j in range(0, self.n):
+            if (rate[j] <= 0.0):
+                continue
+            limits[j] = self.firing_limit(j, x)
+            if (limits[j] < self.n_critical):
+                critical.append(j)
+            else:
+                for i, v in self.leap_change(j, x):
+                    mu[i] += v*rate[j]
+                    sigma2[i] += v*v*rate[j]
+
+        #g_i = 2 for every population, the conservative choice for second order reactions
+        tau1 = float('inf')
+        for i in range(0, len(x)):
+            bound = max(self.epsilon*x[i]/2.0, 1.0)
+            if (mu[i] != 0.0):
+                tau1 = min(tau1, bound/abs(mu[i]))
+            if (sigma2[i] > 0.0):
+                tau1 = min(tau1, bound*bound/sigma2[i])
+        tau1 = min(tau1, self.horizon)
+        if (tau1 < self.ssa_factor/a0):
+            self._ssa_left = self.ssa_steps - 1
+            return self.exact_step()
+
+        a0_critical = 0.0
+        for j in critical:
+            a0_critical += rate[j]
+        while (True):
+            tau2 = float('inf')
+            if (a0_critical > 0.0):
+                tau2 = random.expovariate(a0_critical)
+            fired = -1
+            tau = tau1
+            if (tau2 <= tau1):
+                tau = tau2
+                r = random.random()*a0_critical
+                for j in critical:
+                    r -= rate[j]
+                    fired = j
+                    if (r < 0.0):
+                        break
+            if (tau == float('inf')):
+                return self.exact_step()
+
+            leap = []
+            consumed = [0.0]*len(x)
+            for j in range(0, self.n):
+                if (rate[j] <= 0.0 or limits[j] < self.n_critical):
+                    continue
+                mean = rate[j]*tau
+                if (limits[j] == float('inf')):
+                    k = PoissonRandom(mean)
+                else:
+                    k = BinomialRandom(limits[j], min(1.0, mean/limits[j]))
+                if (k > 0):
+                    leap.append([j, k])
+            if (fired >= 0):
+                leap.append([fired, 1])
+            for j, k in leap:
+                for i, v in self.leap_change(j, x):
+                    if (v < 0):
+                        consumed[i] -= k*v
+            negative = 0
+            for i in range(0, len(x)):
+                if (consumed[i] > x[i] + 1e-9):
+                    negative = 1
+            if (negative == 0):
                 break
+            tau1 = tau1/2.0
+
+        self._leap = leap
+        self.leaps += 1
+        return tau
+
+    def MC_React( self ):
+        if (self._leap is None):
+            return TotalReaction.MC_React( self )
+        events = 0
+        for j, k in self._leap:
+            self.reaction_list[j].react_many( k )
+            events += k
+        self._leap = None
+        return events
+
+    def MC_Discard( self, dt ):
+        self._leap = None
+
+#Name: HybridReaction
+#Desc: Hybrid deterministic/stochastic engine. Reactions of the candidate classes (by default 
+#      antibody Production, Decay and viral Replication) whose reactant populations all hold at 
+#      least threshold members are integrated deterministically: their firing extents grow by
+#      rate*dt (forward Euler, with the step bounded so no population changes by more than a 
+#      fraction epsilon) and the whole firings are applied through react_many(), carrying the
+#      fractional remainder to the next step. All other reactions (stimulation, differentiation, 
+#      low copy reactions) stay on exact SSA over the same step; when one fires at the end of 
+#      the step it is picked on the rates refreshed after the deterministic firings (its 
+#      waiting time was drawn on the rates at the start of the step). The partition is redone 
+#      at every step, so reactions move between the two regimes as populations cross the threshold.
+class HybridReaction( TotalReaction ):
+    def __init__( self, threshold=1000, epsilon=0.03, max_step=0.1, candidates=None ):
+        TotalReaction.__init__( self )
+        self.threshold = threshold
+        self.epsilon = epsilon
+        self.max_step = max_step
+        if (candidates is None):
+            candidates = [Production, Decay, Replication]
+        self.candidates = tuple(candidates)
+        self._eligible = []     #indices of the reactions of a candidate class
+        self._fast = []         #1 if the reaction is currently integrated deterministically
+        self._extent = []       #fractional firings carried over between steps
+        self._firings = None    #[reaction index, firings] of the pending deterministic step
+        self._slow_fires = 0
+
+    def build_graph( self ):
+        TotalReaction.build_graph( self )
+        self._eligible = []
+        for j in range(0, self.n):
+            if (isinstance(self.reaction_list[j], self.candidates) and self._change[j] is not None):
+                self._eligible.append(j)
+        self._fast = [0]*self.n
+        self._extent = [0.0]*self.n
+
+    #the deterministic reactions are kept out of the sum-tree used for the SSA part
+    def partition( self ):
+        rate = self._rate
+        tree = self._tree
+        for j in self._eligible:
+            fast = 1
+            for pop in self.reaction_list[j].depends():
+                if (pop.size() < self.threshold):
+                    fast = 0
+            if (fast == 0 and self._fast[j] == 1):
+                self._extent[j] = 0.0
+            self._fast[j] = fast
+            value = rate[j]
+            if (fast == 1):
+                value = 0.0
+            if (tree.value(j) != value):
+                tree.update( j, value )
+
+    def rate( self ):
+        TotalReaction.rate( self )
+        self.partition()
+
+    def update( self ):
+        TotalReaction.update( self )
+        self.partition()
+
+    def MC_TimeStep( self ):
+        r = random.random()
+        self.update()
+        rate = self._rate
+        fast = []
+        for j in self._eligible:
+            if (self._fast[j] == 1 and rate[j] > 0.0):
+                fast.append(j)
+        slow_rate = self._tree.total()
+        if (len(fast) == 0):
+            self._firings = None
+            if (slow_rate > 0.0):
+                return (1/slow_rate)*math.log(1/r)
+            return 0.0
+
+        #step bounded by the relative change of the deterministically integrated populations
+        dt = min(self.max_step, self.horizon)
+        mu = [0.0]*len(self._species)
+        for j in fast:
+            for i, v in self._change[j]:
+                mu[i] += v*rate[j]
+        for i in range(0, len(mu)):
+            if (mu[i] != 0.0):
+                dt = min(dt, self.epsilon*max(self._species[i].size(), 1)/abs(mu[i]))
+
+        self._slow_fires = 0
+        if (slow_rate > 0.0):
+            dt_slow = (1/slow_rate)*math.log(1/r)
+            if (dt_slow <= dt):
+                dt = dt_slow
+                self._slow_fires = 1
+
+        self._firings = []
+        for j in fast:
+            self._extent[j] += rate[j]*dt
+            k = int(self._extent[j])
+            if (k > 0):
+                self._extent[j] -= k
+                self._firings.append([j, k])
+        return dt
+
+    def MC_React( self ):
+        if (self._firings is None):
+            return TotalReaction.MC_React( self )
+        events = 0
+        for j, k in self._firings:
+            self.reaction_list[j].react_many( k )
+            events += k
+        if (self._slow_fires == 1):
+            #the slow reaction is picked on the rates after the deterministic firings
+            self.update()
+            events += TotalReaction.MC_React( self )
+        self._firings = None
+        return events
+
+    def MC_Discard( self, dt ):
+        self._firings = None
+
+#Name: ReplicateReaction
+#Desc: Replicate batch engine (needs NumPy). Runs R replicates of the same network (differing 
+#      e.g. in the sampled knB, kT4 and kT8 and in their populations) in lockstep on a
+#      (replicates x populations) count matrix and a (replicates x reactions) propensity 
+#      matrix. At every step each replicate draws its waiting time and its reaction in one 
+#      vectorised exponential and categorical draw. The mass-action rates (OrderZero, 
+#      OrderOne, OrderTwo) and the carrying capacity decays are computed from the count 
+#      matrix, and the reactions whose outcomes() only change count populations (formation,
+#      decay and replication of T cells and antigen, T cell stimulation and differentiation,
+#      clearance) are applied to the count matrix. A reaction on the genotypes of a BCell, 
+#      or with a rate of its own (OrderTwoPhenotype), goes through the replicate's objects:
+#      its populations are written back from the matrix, it fires once through react() and
+#      the matrix and the object rates reading a changed population are refreshed. Each 
+#      replicate keeps its own clock; the replicates meet at the observation times and at 
+#      the interventions scheduled on their engines
+class ReplicateReaction:
+    def __init__( self ):
+        if (numpy is None):
+            raise ImportError( "ReplicateReaction needs NumPy" )
+        self.replicates = []    #TotalReaction of every replicate, the same network in each
+        self.populations = []   #populations of every replicate, in the same order for all
+        self._built = False
+
+    def __len__( self ):
+        return len(self.replicates)
+
+    def add_replicate( self, engine, populations ):
+        self.replicates.append( engine )
+        self.populations.append( populations )
+        self._built = False
+
+    #every population a reaction reads or changes
+    def reaction_populations( self, reaction ):
+        pops = []
+        if (hasattr(reaction, 'depends')):
+            for pop in reaction.depends():
+                pops += pop.members()
+        if (hasattr(reaction, 'stoichiometry')):
+            pops += [pop for pop, v in reaction.stoichiometry()]
+        return pops
+
+    #the listed populations of a replicate, then any other population its reactions use
+    def replicate_species( self, r ):
+        species = list(self.populations[r])
+        index = {}
+        for s in range(0, len(species)):
+            index[id(species[s])] = s
+        for reaction in self.replicates[r].reaction_list:
+            for pop in self.reaction_populations( reaction ):
+                if (id(pop) not in index):
+                    index[id(pop)] = len(species)
+                    species.append( pop )
+        return [species, index]
+
+    #how every reaction is computed: its rate from the count matrix or from the object, and
+    #its firings on the count matrix or on the objects
+    def classify( self, reaction, index ):
+        kind = 'object'
+        rate = type(reaction).rate
+        a = []
+        b = []
+        if (rate is OrderZero.rate):
+            kind = 'zero'
+        elif (rate is OrderOne.rate):
+            kind = 'first'
+            a = [index[id(pop)] for pop in reaction.A.members()]
+        elif (rate is OrderTwo.rate):
+            kind = 'second'
+            a = [index[id(pop)] for pop in reaction.A.members()]
+            b = [index[id(pop)] for pop in reaction.B.members()]
+        elif (rate is PopulationDecay.rate or rate is TPopulationDecay.rate):
+            kind = 'capacity'
+            a = [index[id(pop)] for pop in reaction.A.members()]
+        outcomes = None
+        if (hasattr(reaction, 'outcomes')):
+            outcomes = []
+            for p, change in reaction.outcomes():
+                if (len([pop for pop, v in change if (isinstance(pop, BCell) or id(pop) not in index)]) > 0):
+                    outcomes = None
+                    break
+                outcomes.append( [p, [[index[id(pop)], v] for pop, v in change]] )
+        return [kind, a, b, outcomes]
+
+    def build( self ):
+        R = len(self.replicates)
+        if (R == 0):
+            raise ValueError( "ReplicateReaction has no replicates" )
+        self._species = []
+        self._index = []
+        for r in range(0, R):
+            species, index = self.replicate_species( r )
+            self._species.append( species )
+            self._index.append( index )
+        reaction_list = self.replicates[0].reaction_list
+        M = len(reaction_list)
+        S = len(self._species[0])
+        self._classes = [self.classify( reaction, self._index[0] ) for reaction in reaction_list]
+        for r in range(1, R):
+            reactions = self.replicates[r].reaction_list
+            if (len(reactions) != M or len(self._species[r]) != S or
+                    [type(x) for x in reactions] != [type(x) for x in reaction_list] or
+                    [self.classify( reactions[j], self._index[r] ) for j in range(0, M)] != self._classes):
+                raise ValueError( "replicate " + str(r) + " is not the network of replicate 0" )
+
+        kinds = [c[0] for c in self._classes]
+        self._zero = numpy.array([j for j in range(0, M) if kinds[j] == 'zero'], dtype=int)
+        self._first = numpy.array([j for j in range(0, M) if kinds[j] == 'first'], dtype=int)
+        self._second = numpy.array([j for j in range(0, M) if kinds[j] == 'second'], dtype=int)
+        self._capacity = numpy.array([j for j in range(0, M) if kinds[j] == 'capacity'], dtype=int)
+        self._object = [j for j in range(0, M) if kinds[j] == 'object']
+        self._A = numpy.zeros( (S, M) )     #members of the first and second reactant
+        self._B = numpy.zeros( (S, M) )
+        for j in range(0, M):
+            for s in self._classes[j][1]:
+                self._A[s, j] += 1.0
+            for s in self._classes[j][2]:
+                self._B[s, j] += 1.0
+
+        #outcome table of the count reactions: cumulative probabilities and count changes
+        self._counted = numpy.array([self._classes[j][3] is not None for j in range(0, M)])
+        n_out = max([1] + [len(c[3]) for c in self._classes if c[3] is not None])
+        self._cumulative = numpy.ones( (M, n_out) )
+        self._delta = numpy.zeros( (M, n_out, S) )
+        for j in range(0, M):
+            outcomes = self._classes[j][3]
+            if (outcomes is None):
+                continue
+            p = 0.0
+            for o in range(0, len(outcomes)):
+                p += outcomes[o][0]
+                self._cumulative[j, o] = p
+                for s, v in outcomes[o][1]:
+                    self._delta[j, o, s] += v
+            self._cumulative[j, len(outcomes)-1:] = 1.0
+
+        #object rates reading each population
+        self._readers = [[] for s in range(0, S)]
+        self._reads = numpy.zeros( (S, M) )
+        for j in self._object:
+            reaction = reaction_list[j]
+            if (not hasattr(reaction, 'depends')):
+                raise ValueError( "reaction " + str(j) + " has no depends()" )
+            for pop in reaction.depends():
+                for member in pop.members():
+                    s = self._index[0][id(member)]
+                    if (j not in self._readers[s]):
+                        self._readers[s].append( j )
+                        self._reads[s, j] = 1.0
+        self._plain = numpy.array([not isinstance(pop, BCell) for pop in self._species[0]])
+
+        self._rng = numpy.random.default_rng( random.getrandbits(63) )
+        self._X = numpy.zeros( (R, S) )
+        self._P = numpy.zeros( (R, M) )
+        self._K = numpy.zeros( (R, M) )         #rate constant (minimum decay rate of the capacity decays)
+        self._Kr = numpy.ones( (R, M) )         #replication rate and capacity of the capacity decays
+        self._cap = numpy.ones( (R, M) )
+        self._seen = [None]*R
+        for r in range(0, R):
+            self.load( r )
+        self._built = True
+
+    #reads the populations, rate constants and object rates of replicate r
+    def load( self, r ):
+        reactions = self.replicates[r].reaction_list
+        for j in range(0, len(reactions)):
+            kind = self._classes[j][0]
+            if (kind == 'capacity'):
+                self._K[r, j] = reactions[j].k
+                self._Kr[r, j] = reactions[j].r
+                self._cap[r, j] = reactions[j].capacity
+            elif (kind != 'object'):
+                self._K[r, j] = reactions[j]._k
+        self._X[r] = [pop.size() for pop in self._species[r]]
+        self._seen[r] = [pop._version for pop in self._species[r]]
+        for j in self._object:
+            self._P[r, j] = reactions[j].rate()
+
+    #writes the counts of replicate r back to its populations
+    def store( self, r ):
+        x = self._X[r]
+        species = self._species[r]
+        for s in range(0, len(species)):
+            if (self._plain[s]):
+                value = species[s].size()
+                if (value != x[s]):
+                    species[s].set_size( type(value)(x[s]) )
+
+    #after the objects of replicate r changed: the counts and the object rates reading a
+    #changed population are read again
+    def refresh( self, r ):
+        species = self._species[r]
+        seen = self._seen[r]
+        x = self._X[r]
+        stale = {}
+        for s in range(0, len(species)):
+            version = species[s]._version
+            if (version != seen[s]):
+                seen[s] = version
+                x[s] = species[s].size()
+                for j in self._readers[s]:
+                    stale[j] = 1
+        reactions = self.replicates[r].reaction_list
+        for j in stale:
+            self._P[r, j] = reactions[j].rate()
+
+    #the count matrix rates of every replicate, the object rates are kept in place
+    def rates( self ):
+        if (not self._built):
+            self.build()
+        X = self._X
+        P = self._P
+        K = self._K
+        if (len(self._zero) > 0):
+            P[:, self._zero] = K[:, self._zero]
+        if (len(self._first) > 0):
+            P[:, self._first] = K[:, self._first] * numpy.dot( X, self._A[:, self._first] )
+        if (len(self._second) > 0):
+            P[:, self._second] = K[:, self._second] * numpy.dot( X, self._A[:, self._second] ) * numpy.dot( X, self._B[:, self._second] )
+        if (len(self._capacity) > 0):
+            c = self._capacity
+            n = numpy.dot( X, self._A[:, c] )
+            P[:, c] = numpy.maximum( K[:, c], self._Kr[:, c] * (n/self._cap[:, c]) ) * n
+        return P
+
+    def counts( self ):
+        if (not self._built):
+            self.build()
+        return self._X[:, 0:len(self.populations[0])].copy()
+
+    #one lockstep step of the replicates in rows, which stop at t_stop. returns the rows still
+    #running and the number of firings
+    def step( self, rows, T, t_stop ):
+        P = self.rates()
+        a = P[rows]
+        cumulative = numpy.cumsum( a, axis=1 )
+        a0 = cumulative[:, -1]
+        with numpy.errstate( divide='ignore' ):
+            dt = self._rng.standard_exponential( len(rows) ) / a0
+        t_next = T[rows] + dt
+        done = ~(t_next <= t_stop)
+        T[rows[done]] = t_stop
+        fire = ~done
+        rows = rows[fire]
+        if (len(rows) == 0):
+            return [rows, 0]
+        T[rows] = t_next[fire]
+        a = a[fire]
+        cumulative = cumulative[fire]
+        target = self._rng.random( len(rows) ) * cumulative[:, -1]
+        j = numpy.minimum( (cumulative <= target[:, None]).sum( axis=1 ), a.shape[1] - 1 )
+        #rounding can land on a zero rate, take the last positive one instead
+        empty = a[numpy.arange( len(rows) ), j] <= 0.0
+        if (empty.any()):
+            j[empty] = a.shape[1] - 1 - numpy.argmax( a[empty][:, ::-1] > 0.0, axis=1 )
+
+        counted = self._counted[j]
+        if (counted.any()):
+            r_count = rows[counted]
+            j_count = j[counted]
+            u = self._rng.random( len(r_count) )
+            o = (u[:, None] > self._cumulative[j_count, :-1]).sum( axis=1 )
+            delta = self._delta[j_count, o]
+            self._X[r_count] = numpy.maximum( self._X[r_count] + delta, 0.0 )
+            stale = numpy.dot( delta != 0.0, self._reads ) > 0.0
+            for r in r_count[stale.any( axis=1 )]:
+                self.store( r )
+                self.refresh( r )
+        for r, i in zip( rows[~counted], j[~counted] ):
+            self.store( r )
+            self.replicates[r].reaction_list[i].react()
+            self.refresh( r )
+            self.object_events += 1
+        return [rows, len(rows)]
+
+    #applies the interventions of every replicate due at t (before t_end)
+    def intervene( self, t, t_end ):
+        applied = 0
+        for r in range(0, len(self.replicates)):
+            schedule = self.replicates[r]._schedule
+            if (len(schedule) > 0 and schedule[0][0] <= t and schedule[0][0] < t_end):
+                self.store( r )
+                while (len(schedule) > 0 and schedule[0][0] <= t and schedule[0][0] < t_end):
+                    event = schedule.pop(0)
+                    event[2]( *event[3] )
+                    applied += 1
+                #an intervention may change rate constants as well as populations
+                self.load( r )
+        return applied
+
+    #as TotalReaction.advance for every replicate, with the interventions scheduled on the
+    #replicate engines. observer(time, counts) is called with the count matrix of the listed 
+    #populations at each of the obs_times within (t, t_end]; the populations of the replicates
+    #are up to date when it is called and on return. returns the summed statistics
+    def advance( self, t, t_end, observer=None, obs_times=None ):
+        start = time.time()
+        if (not self._built):
+            self.build()
+        sync = [t_end]
+        if (obs_times is not None):
+            sync += [x for x in obs_times if (x > t and x < t_end)]
+        for engine in self.replicates:
+            sync += [event[0] for event in engine._schedule if (event[0] > t and event[0] < t_end)]
+        sync = sorted( set( sync ) )
+        stats = {}
+        stats['steps'] = 0
+        stats['events'] = 0
+        stats['interventions'] = 0
+        stats['jumps'] = 0
+        stats['accelerated'] = 0.0
+        self.object_events = 0
+        T = numpy.full( len(self.replicates), float(t) )
+        for t_sync in sync:
+            stats['interventions'] += self.intervene( t, t_end )
+            rows = numpy.arange( len(self.replicates) )
+            while (len(rows) > 0):
+                rows, fired = self.step( rows, T, t_sync )
+                stats['steps'] += 1
+                stats['events'] += fired
+            t = t_sync
+            for r in range(0, len(self.replicates)):
+                self.store( r )
+            if (observer is not None and (obs_times is None or t in obs_times)):
+                observer( t, self.counts() )
+        stats['t'] = t
+        stats['object_events'] = self.object_events
+        stats['wall_time'] = time.time() - start
+        return stats
 
 #Name: AntigenFileInput
 #Desc: Inputs the antigen information in terms of antigen and epitope parameters
@@ -1416,7 +3927,7 @@ class FileOutput:
 		self._antigen4 = self._antigen_list[3]        
 
 	def write( self, time ):
-		if (time == 0.0 or time > (self.time + self.step)):
+		if (time == 0.0 or time > (self.time + self.step) - 1e-9):
 			line_out = ''
             #  tau = 8.0, check!
 			line_out += str( time*8.0/24.0 ) +';'
@@ -2211,6 +4722,15 @@ class FileOutput:
 	def set_time( t ):
 		self.time = t
 
+	#output times from the last written row up to t_end, for TotalReaction.advance
+	def times( self, t_end ):
+		output = []
+		i = 1
+		while (self.time + i*self.step <= t_end):
+			output.append( self.time + i*self.step )
+			i += 1
+		return output
+
 
 	def gene_out( self ):
 		gene_file = self.data_file + ".gen"